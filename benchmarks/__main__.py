@@ -0,0 +1,192 @@
+import tracemalloc
+import typing as t
+from argparse import ArgumentParser
+from asyncio import run
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from orjson import OPT_INDENT_2, dumps
+
+from koleo.api import KoleoAPI, MetricsRegistry, ReplayServer
+from koleo.api.replay import Exchange, load_archive, save_archive
+from koleo.cli import CLI
+from koleo.storage import Storage
+
+from .fixtures import build_fixtures
+
+
+BENCHMARK_DATE = datetime(2025, 6, 2, 8, 0)
+
+
+class Scenario(t.NamedTuple):
+    name: str
+    view: t.Callable[[CLI, datetime], t.Awaitable[t.Any]]
+
+
+SCENARIOS = [
+    Scenario("stations", lambda cli, date: cli.find_station_view("Warszawa", None, None)),
+    Scenario("departures", lambda cli, date: cli.full_departures_view("Warszawa Centralna", date)),
+    Scenario("all", lambda cli, date: cli.all_trains_view("Warszawa Centralna", date)),
+    Scenario("all-hub", lambda cli, date: cli.all_trains_view("Warszawa Wschodnia", date)),
+    Scenario(
+        "connections",
+        lambda cli, date: cli.connections_view("Warszawa Centralna", "Kraków Główny", date, [], False, False, False),
+    ),
+    Scenario("trainroute", lambda cli, date: cli.train_info_view("IC", "5301", date, False)),
+    Scenario("trainstats", lambda cli, date: cli.train_passenger_stats_view("IC", "5300", date)),
+    Scenario(
+        "trainstats-detailed", lambda cli, date: cli.train_passenger_stats_view("IC", "5300", date, detailed=True)
+    ),
+    Scenario(
+        "seatfinder",
+        lambda cli, date: cli.seatfinder_view("IC", "5300", date, window=True, pair=True, end="front"),
+    ),
+    Scenario(
+        "matrix",
+        lambda cli, date: cli.connections_matrix_view(
+            ["Warszawa Centralna", "Kraków Główny", "Poznań Główny", "Łódź Fabryczna"], date, [], False, length=1
+        ),
+    ),
+    Scenario(
+        "local",
+        lambda cli, date: cli.local_connections_view("Gdańsk Główny", "Katowice", date, [], False, length=3),
+    ),
+]
+
+
+class ReplayClient(KoleoAPI):
+    # not KoleoAPI.replay, that one stops the server on close and every run shares it
+    def __init__(self, server: ReplayServer):
+        super().__init__()
+        self.server = server
+        self.base_url = server.rewrite(self.base_url)
+        self.metrics = MetricsRegistry()
+
+    async def request(self, method, url: str, *args, **kwargs):
+        return await super().request(method, self.server.rewrite(url), *args, **kwargs)
+
+
+class Result(t.NamedTuple):
+    name: str
+    times: list[float]
+    requests: int
+    peak_memory: int
+    status: str
+    output: str
+
+
+async def run_once(scenario: Scenario, server: ReplayServer, storage: Storage) -> tuple[float, int, int, str, str]:
+    cli = CLI()
+    cli.client, cli.storage = ReplayClient(server), storage
+    cli.init_console(True, "text")
+    output, status = StringIO(), "ok"
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = perf_counter()
+    with redirect_stdout(output):
+        try:
+            await scenario.view(cli, BENCHMARK_DATE)
+        except SystemExit:
+            status = "exited"
+        except Exception as e:
+            # a broken view shouldn't stop the other scenarios, the error is shown in the results instead
+            status = type(e).__name__
+    elapsed = perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    await cli.client.close()
+    return elapsed, len(cli.client.metrics.requests), peak, status, output.getvalue()
+
+
+async def run_scenario(scenario: Scenario, server: ReplayServer, repeat: int, warm: bool, config: str) -> Result:
+    # the first run is discarded so lazy imports aren't measured, with --warm it also fills the cache
+    # every measured run shares, otherwise each run starts from an empty one
+    storage = Storage.load(path=config)
+    await run_once(scenario, server, storage)
+    times, requests, peaks, status, output = [], 0, [], "ok", ""
+    for _ in range(repeat):
+        if not warm:
+            storage = Storage.load(path=config)
+        elapsed, requests, peak, status, output = await run_once(scenario, server, storage)
+        times.append(elapsed)
+        peaks.append(peak)
+    return Result(scenario.name, times, requests, max(peaks), status, output)
+
+
+async def benchmark(
+    scenarios: list[Scenario], exchanges: list[Exchange], repeat: int, warm: bool, latency: float, verbose: bool
+) -> list[Result]:
+    server = ReplayServer(exchanges, latency)
+    await server.start()
+    tracemalloc.start()
+    results = []
+    try:
+        with TemporaryDirectory() as tmp:
+            for scenario in scenarios:
+                result = await run_scenario(scenario, server, repeat, warm, f"{tmp}/{scenario.name}.json")
+                results.append(result)
+                print(
+                    f"{result.name:<20} {median(result.times) * 1000:>9.1f}ms {min(result.times) * 1000:>9.1f}ms {result.requests:>5} {result.peak_memory / 1024:>9.0f}KiB"
+                    + (f" {result.status}" if result.status != "ok" else "")
+                )
+                if verbose:
+                    print(result.output)
+    finally:
+        tracemalloc.stop()
+        await server.stop()
+    if server.misses:
+        print(f"{len(server.misses)} requests weren't recorded:")
+        for miss in sorted(set(server.misses)):
+            print(f"  {miss}")
+    return results
+
+
+def main():
+    parser = ArgumentParser("benchmarks", description="Run koleo-cli views against a local replay of the Koleo API")
+    parser.add_argument("scenarios", help="scenarios to run, all by default", nargs="*")
+    parser.add_argument("-n", "--repeat", help="runs per scenario", type=int, default=5)
+    parser.add_argument("--warm", help="fill the cache before measuring", action="store_true", default=False)
+    parser.add_argument("--latency", help="simulated server latency in seconds", type=float, default=0)
+    parser.add_argument(
+        "--fixtures", help="replay an archive written by koleo --record instead of the synthetic network"
+    )
+    parser.add_argument("--dump_fixtures", help="write the synthetic exchanges to an archive and exit")
+    parser.add_argument("-o", "--output", help="write the results to a json file")
+    parser.add_argument("-v", "--verbose", help="show the output of every view", action="store_true", default=False)
+    args = parser.parse_args()
+    if unknown := set(args.scenarios) - {i.name for i in SCENARIOS}:
+        parser.error(f"unknown scenarios: {", ".join(sorted(unknown))}")
+
+    exchanges = load_archive(args.fixtures) if args.fixtures else build_fixtures(BENCHMARK_DATE)
+    if args.dump_fixtures:
+        save_archive(args.dump_fixtures, exchanges)
+        return
+    scenarios = [i for i in SCENARIOS if not args.scenarios or i.name in args.scenarios]
+    print(f"{"scenario":<20} {"median":>11} {"min":>11} {"reqs":>5} {"peak mem":>12}")
+    results = run(benchmark(scenarios, exchanges, args.repeat, args.warm, args.latency, args.verbose))
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(
+                dumps(
+                    [
+                        {
+                            "name": i.name,
+                            "median": median(i.times),
+                            "min": min(i.times),
+                            "times": i.times,
+                            "requests": i.requests,
+                            "peak_memory": i.peak_memory,
+                            "status": i.status,
+                        }
+                        for i in results
+                    ],
+                    option=OPT_INDENT_2,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
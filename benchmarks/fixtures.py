@@ -0,0 +1,510 @@
+import random
+import typing as t
+from datetime import datetime, timedelta
+
+from orjson import dumps
+
+from koleo.api.replay import Exchange
+from koleo.utils import name_to_slug
+
+
+API = "https://api.koleo.pl"
+WEB = "https://koleo.pl"
+
+BRANDS = [
+    {"id": 28, "name": "IC", "display_name": "PKP Intercity", "logo_text": "IC", "color": "#f18a00", "carrier_id": 1},
+    {"id": 2, "name": "EIC", "display_name": "PKP Intercity", "logo_text": "EIC", "color": "#f18a00", "carrier_id": 1},
+    {"id": 1, "name": "TLK", "display_name": "PKP Intercity", "logo_text": "TLK", "color": "#f18a00", "carrier_id": 1},
+    {"id": 10, "name": "REG", "display_name": "POLREGIO", "logo_text": "R", "color": "#d5001c", "carrier_id": 2},
+]
+STATION_NAMES = {
+    1: "Warszawa Centralna",
+    2: "Warszawa Zachodnia",
+    3: "Łódź Fabryczna",
+    4: "Kraków Główny",
+    5: "Katowice",
+    6: "Poznań Główny",
+    7: "Gdańsk Główny",
+    8: "Wrocław Główny",
+    9: "Kutno",
+    10: "Częstochowa",
+}
+# brand id, first train number, stations, minutes between consecutive stations
+LINES = [
+    (28, 5300, [7, 1, 2, 3, 10, 4], [170, 6, 70, 80, 95]),
+    (2, 1100, [6, 9, 2, 1, 5, 4], [80, 70, 6, 150, 50]),
+    (1, 8300, [8, 3, 9, 1], [200, 45, 75]),
+    (10, 90100, [9, 2, 1], [75, 6]),
+]
+FIRST_DEPARTURE, LAST_DEPARTURE = 5, 21
+# a station with only its boards, sized like the busiest real ones so the all view is measured at hub scale
+HUB_ID, HUB_NAME, HUB_TRAINS = 11, "Warszawa Wschodnia", 2500
+SEAT_TYPES = (4, 5)
+CARRIAGES = {4: ["1", "2"], 5: ["3", "4", "5", "6"]}
+
+
+def station(id: int) -> dict[str, t.Any]:
+    name = HUB_NAME if id == HUB_ID else STATION_NAMES[id]
+    return {
+        "id": id,
+        "name": name,
+        "name_slug": name_to_slug(name),
+        "latitude": 52.0 + id / 10,
+        "longitude": 19.0 + id / 10,
+        "hits": 1000 - id,
+        "ibnr": 5100000 + id,
+        "city": name.split(" ")[0],
+        "region": "",
+        "country": "Polska",
+        "localised_name": name,
+        "is_group": False,
+        "has_announcements": False,
+        "is_nearby_station_enabled": False,
+        "is_livesearch_displayable": True,
+        "type": "railStopPlace",
+        "transport_mode": "rail",
+        "time_zone": "Europe/Warsaw",
+    }
+
+
+def time_dict(dt: datetime) -> dict[str, int]:
+    return {"hour": dt.hour, "minute": dt.minute, "second": 0}
+
+
+class Train(t.NamedTuple):
+    id: int
+    nr: int
+    brand_id: int
+    # station id, arrival, departure, distance in meters
+    calls: list[tuple[int, datetime, datetime, int]]
+
+
+def make_trains(date: datetime) -> list[Train]:
+    day = datetime.combine(date.date(), datetime.min.time())
+    trains = []
+    for line, (brand_id, first_nr, stations, minutes) in enumerate(LINES):
+        for reverse in (False, True):
+            route = list(zip(stations[::-1], [0, *minutes[::-1]])) if reverse else list(zip(stations, [0, *minutes]))
+            for n, hour in enumerate(range(FIRST_DEPARTURE, LAST_DEPARTURE + 1, 1 if brand_id == 10 else 2)):
+                current, distance, calls = day + timedelta(hours=hour, minutes=7 * line), 0, []
+                for station_id, travel in route:
+                    current += timedelta(minutes=travel)
+                    distance += travel * 1500
+                    calls.append((station_id, current, current + timedelta(minutes=2), distance))
+                nr = first_nr + n * 2 + reverse
+                trains.append(Train(1_000_000 + date.toordinal() % 1000 * 1000 + len(trains), nr, brand_id, calls))
+    return trains
+
+
+def train_detail(train: Train) -> dict[str, t.Any]:
+    return {
+        "train": {
+            "id": train.id,
+            "train_nr": train.nr,
+            "name": None,
+            "train_full_name": str(train.nr),
+            "run_desc": "",
+            "carrier_id": 1,
+            "brand_id": train.brand_id,
+            "train_name": train.nr,
+            "duration_offset": 0,
+            "db_train_nr": train.nr,
+            "train_attributes": [],
+        },
+        "stops": [
+            {
+                "id": train.id * 100 + n,
+                "station_id": station_id,
+                "station_name": STATION_NAMES[station_id],
+                "station_slug": name_to_slug(STATION_NAMES[station_id]),
+                "train_id": train.id,
+                "arrival": time_dict(arrival),
+                "departure": time_dict(departure),
+                "position": n,
+                "train_nr": train.nr,
+                "brand_id": train.brand_id,
+                "distance": distance,
+                "entry_only": False,
+                "exit_only": False,
+                "station_display_name": STATION_NAMES[station_id],
+                "platform": ["I", "II", "III", "IV"][n % 4],
+                "vehicle_type": None,
+            }
+            for n, (station_id, arrival, departure, distance) in enumerate(train.calls)
+        ],
+    }
+
+
+def board(trains: list[Train], station_id: int, type: int) -> list[dict[str, t.Any]]:
+    entries = []
+    for train in trains:
+        for n, (call_station, arrival, departure, _) in enumerate(train.calls):
+            if call_station != station_id or n == (len(train.calls) - 1 if type == 1 else 0):
+                continue
+            end = train.calls[-1 if type == 1 else 0][0]
+            entries.append(
+                {
+                    "arrival": arrival.isoformat() if type == 2 else None,
+                    "departure": departure.isoformat() if type == 1 else None,
+                    "stations": [
+                        {
+                            "id": end,
+                            "name": STATION_NAMES[end],
+                            "name_slug": name_to_slug(STATION_NAMES[end]),
+                            "train_id": train.id,
+                        }
+                    ],
+                    "train_full_name": str(train.nr),
+                    "brand_id": train.brand_id,
+                    "platform": ["I", "II", "III", "IV"][n % 4],
+                    "track": str(n % 6 + 1),
+                }
+            )
+    return sorted(entries, key=lambda i: i["departure"] or i["arrival"])
+
+
+def hub_board(date: datetime, type: int) -> list[dict[str, t.Any]]:
+    day = datetime.combine(date.date(), datetime.min.time())
+    rng = random.Random(type)
+    entries = []
+    for n in range(HUB_TRAINS):
+        at = day + timedelta(minutes=rng.randrange(FIRST_DEPARTURE * 60, 24 * 60))
+        end = rng.choice(list(STATION_NAMES))
+        brand = rng.choice(BRANDS)
+        entries.append(
+            {
+                "arrival": at.isoformat() if type == 2 else None,
+                "departure": at.isoformat() if type == 1 else None,
+                "stations": [
+                    {
+                        "id": end,
+                        "name": STATION_NAMES[end],
+                        "name_slug": name_to_slug(STATION_NAMES[end]),
+                        "train_id": 2_000_000 + type * HUB_TRAINS + n,
+                    }
+                ],
+                "train_full_name": str(10_000 + n),
+                "brand_id": brand["id"],
+                "platform": ["I", "II", "III", "IV"][n % 4],
+                "track": str(n % 6 + 1),
+            }
+        )
+    return sorted(entries, key=lambda i: i["departure"] or i["arrival"])
+
+
+def leg_calls(train: Train, start: int, end: int) -> tuple[int, int] | None:
+    ids = [i[0] for i in train.calls]
+    if start in ids and end in ids and ids.index(start) < ids.index(end):
+        return ids.index(start), ids.index(end)
+    return None
+
+
+def connection_id(train: Train, start: int, end: int) -> int:
+    return train.id * 100 + start * 10 + end
+
+
+def v1_connection(train: Train, start: int, end: int) -> dict[str, t.Any]:
+    first, last = leg_calls(train, start, end)
+    departure, arrival = train.calls[first][2], train.calls[last][1]
+    distance = (train.calls[last][3] - train.calls[first][3]) // 1000
+    stops = [
+        {
+            "arrival": arr.isoformat(),
+            "departure": dep.isoformat(),
+            "distance": meters,
+            "in_path": first <= n <= last,
+            "station_id": station_id,
+            "next_day": False,
+            "position": n,
+            "train_nr": train.nr,
+            "brand_id": train.brand_id,
+            "entry_only": False,
+            "exit_only": False,
+            "platform": ["I", "II", "III", "IV"][n % 4],
+            "track": str(n % 6 + 1),
+            "on_demand": False,
+        }
+        for n, (station_id, arr, dep, meters) in enumerate(train.calls)
+    ]
+    return {
+        "id": connection_id(train, start, end),
+        "distance": distance,
+        "purchasable": True,
+        "purchasable_errors": [],
+        "travel_time": int((arrival - departure).total_seconds() // 60),
+        "changes": 0,
+        "needs_document": False,
+        "brand_ids": [train.brand_id],
+        "start_station_id": start,
+        "end_station_id": end,
+        "arrival": arrival.isoformat(),
+        "departure": departure.isoformat(),
+        "bookable": True,
+        "special_event_slug": None,
+        "is_advanced_travel_options": False,
+        "is_child_birthday_required": False,
+        "max_passengers_count": False,
+        "constriction_info": [],
+        "is_estimated_timetable_available": False,
+        "eol_connection_uuid": None,
+        "trains": [
+            {
+                **train_detail(train)["train"],
+                "arrival": arrival.isoformat(),
+                "departure": departure.isoformat(),
+                "stops": stops,
+                "bookable": True,
+                "train_attribute_ids": [],
+                "travel_time": int((arrival - departure).total_seconds() // 60),
+                "direction": STATION_NAMES[train.calls[-1][0]],
+                "start_station_id": start,
+                "end_station_id": end,
+                "fixed_carriage_composition": False,
+                "is_option_groups_available": False,
+                "train_id": train.id,
+            }
+        ],
+    }
+
+
+def v3_connection(train: Train, start: int, end: int) -> dict[str, t.Any]:
+    first, last = leg_calls(train, start, end)
+    departure, arrival = train.calls[first][2], train.calls[last][1]
+    calls = [
+        {
+            "station_id": station_id,
+            "arrival": arr.isoformat(),
+            "departure": dep.isoformat(),
+            "platform": "I",
+            "track": "1",
+        }
+        for station_id, arr, dep, _ in train.calls
+    ]
+    return {
+        "uuid": f"{train.id}-{start}-{end}",
+        "eol_response_version": 1,
+        "departure": departure.isoformat(),
+        "arrival": arrival.isoformat(),
+        "origin_station_id": start,
+        "destination_station_id": end,
+        "duration": int((arrival - departure).total_seconds() // 60),
+        "changes": 0,
+        "constrictions": [],
+        "legs": [
+            {
+                "leg_type": "train_leg",
+                "duration": int((arrival - departure).total_seconds() // 60),
+                "origin_station_id": start,
+                "destination_station_id": end,
+                "departure": departure.isoformat(),
+                "arrival": arrival.isoformat(),
+                "train_id": train.id,
+                "train_nr": train.nr,
+                "train_name": "",
+                "train_full_name": str(train.nr),
+                "operating_day": departure.strftime("%Y-%m-%d"),
+                "commercial_brand_id": train.brand_id,
+                "internal_brand_id": train.brand_id,
+                "constrictions": [],
+                "departure_platform": "I",
+                "departure_track": "1",
+                "arrival_platform": "II",
+                "arrival_track": "2",
+                "stops_before_leg": calls[:first],
+                "stops_in_leg": calls[first : last + 1],
+                "stops_after_leg": calls[last + 1 :],
+                "attributes": [],
+            }
+        ],
+    }
+
+
+def direct_trains(trains: list[Train], start: int, end: int, after: datetime, limit: int = 10) -> list[Train]:
+    found = [i for i in trains if (calls := leg_calls(i, start, end)) and i.calls[calls[0]][2] >= after]
+    return sorted(found, key=lambda i: i.calls[leg_calls(i, start, end)[0]][2])[:limit]
+
+
+def seats(train: Train, place_type: int) -> dict[str, t.Any]:
+    rng = random.Random(train.id * 10 + place_type)
+    occupancy = rng.uniform(0.2, 0.9)
+    return {
+        "special_compartment_types": [
+            {"id": 1, "icon": "quiet", "name": "Strefa ciszy", "information": "", "terms": ""},
+            {"id": 2, "icon": "bike", "name": "Rowery", "information": "", "terms": ""},
+        ],
+        "seats": [
+            {
+                "carriage_nr": carriage,
+                "seat_nr": f"{compartment}{seat}",
+                "special_compartment_type_id": 2
+                if carriage == CARRIAGES[place_type][-1] and compartment == 1
+                else None,
+                "state": "RESERVED" if rng.random() < occupancy else "FREE",
+                "placement_id": 1 if seat in (1, 2, 5, 6) else 2,
+            }
+            for carriage in CARRIAGES[place_type]
+            for compartment in range(1, 10)
+            for seat in range(1, 9 if place_type == 5 else 7)
+        ],
+    }
+
+
+def composition(place_type: int) -> dict[str, t.Any]:
+    return {
+        "direction": {"type": "simple", "direction": "right", "reversingOnRoute": False},
+        "carriages": [
+            {"positon": n, "number": carriage, "carriage_type_id": place_type, "bookable": True, "is_default": True}
+            for n, carriage in enumerate(CARRIAGES[place_type])
+        ],
+    }
+
+
+def carriage_type(place_type: int) -> dict[str, t.Any]:
+    per_compartment = 8 if place_type == 5 else 6
+    return {
+        "id": place_type,
+        "key": f"type-{place_type}",
+        "image_key": "",
+        "seats": [
+            {
+                "nr": compartment * 10 + seat,
+                "seat_type_id": 1,
+                "x": compartment * 4 + (seat - 1) // 2,
+                "y": (seat - 1) % 2 * 3,
+                "color": None,
+                "compartment_type_id": None,
+                "placement_id": None,
+            }
+            for compartment in range(1, 10)
+            for seat in range(1, per_compartment + 1)
+        ],
+        "seat_types": [{"id": 1, "key": "seat", "width": 1, "height": 1}],
+    }
+
+
+def exchange(
+    url: str,
+    response: t.Any,
+    *,
+    method: str = "GET",
+    params: dict[str, t.Any] | None = None,
+    json: t.Any = None,
+    status: int = 200,
+) -> Exchange:
+    query = []
+    for key, value in (params or {}).items():
+        for item in value if isinstance(value, list) else [value]:
+            query.append([key, str(item)])
+    return {
+        "method": method,
+        "url": url,
+        "params": query,
+        "json": json,
+        "status": status,
+        "headers": {"Content-Type": "application/json"},
+        "body": dumps(response).decode(),
+    }
+
+
+def connection_params(start: int, end: int, brand_ids: list[int], date: datetime, direct: bool) -> dict[str, t.Any]:
+    return {
+        "query[date]": date.strftime("%d-%m-%Y %H:%M:%S"),
+        "query[start_station]": name_to_slug(STATION_NAMES[start]),
+        "query[end_station]": name_to_slug(STATION_NAMES[end]),
+        "query[only_purchasable]": "false",
+        "query[only_direct]": str(direct).lower(),
+        "query[brand_ids][]": brand_ids,
+    }
+
+
+def build_fixtures(date: datetime) -> list[Exchange]:
+    # a small but consistent network, every view in the scenarios finds what it asks for
+    trains = make_trains(date)
+    day = date.strftime("%Y-%m-%d")
+    stations = [station(i) for i in [*STATION_NAMES, HUB_ID]]
+    brand_ids = [i["id"] for i in BRANDS]
+    exchanges = [
+        exchange(f"{API}/v2/main/brands", BRANDS),
+        exchange(f"{API}/v2/main/stations", stations),
+        exchange(f"{API}/v2/main/train_attributes", []),
+        exchange(f"{API}/v2/main/carriage_types", [carriage_type(i) for i in SEAT_TYPES]),
+    ]
+    for st in stations:
+        exchanges += [
+            exchange(f"{API}/v2/main/stations/by_slug/{st["name_slug"]}", st),
+            exchange(f"{API}/v2/main/stations/by_id/{st["id"]}", st),
+        ]
+        for type, kind in ((1, "departures"), (2, "arrivals")):
+            entries = hub_board(date, type) if st["id"] == HUB_ID else board(trains, st["id"], type)
+            exchanges.append(exchange(f"{API}/v2/main/timetables/{st["id"]}/{day}/{kind}", entries))
+    for query in ("Warszawa", "Kraków", "Główny"):
+        found = [
+            {k: st[k] for k in ("id", "name", "name_slug", "ibnr", "localised_name", "type")} | {"on_demand": False}
+            for st in stations
+            if query.lower() in st["name"].lower()
+        ]
+        exchanges.append(exchange(f"{API}/ls", {"stations": found}, params={"q": query, "language": "pl"}))
+    brand_names = {i["id"]: i["name"] for i in BRANDS}
+    for train in trains:
+        detail = train_detail(train)
+        exchanges += [
+            exchange(f"{WEB}/pl/trains/{train.id}", detail),
+            exchange(
+                f"{WEB}/pl/train_calendars",
+                {
+                    "train_calendars": [
+                        {
+                            "id": train.id,
+                            "train_nr": train.nr,
+                            "train_name": "",
+                            "trainBrand": train.brand_id,
+                            "dates": [day],
+                            "train_ids": [train.id],
+                            "date_train_map": {day: train.id},
+                        }
+                    ]
+                },
+                params={"brand": brand_names[train.brand_id], "nr": train.nr},
+            ),
+        ]
+        # the direct search the seat views use to find the connection id of the whole train
+        start, end = train.calls[0][0], train.calls[-1][0]
+        first_departure = datetime.combine(date.date(), train.calls[0][2].time())
+        exchanges.append(
+            exchange(
+                f"{API}/v2/main/connections",
+                {"connections": [v1_connection(train, start, end)]},
+                params=connection_params(start, end, [train.brand_id], first_departure, True),
+            )
+        )
+        cid = connection_id(train, start, end)
+        for place_type in SEAT_TYPES:
+            exchanges += [
+                exchange(f"{API}/v2/main/seats_availability/{cid}/{train.nr}/{place_type}", seats(train, place_type)),
+                exchange(f"{API}/v2/main/train_composition/{cid}/{train.nr}/{place_type}", composition(place_type)),
+            ]
+    for start in STATION_NAMES:
+        for end in STATION_NAMES:
+            if start == end:
+                continue
+            found = direct_trains(trains, start, end, date)
+            exchanges += [
+                exchange(
+                    f"{API}/v2/main/connections",
+                    {"connections": [v1_connection(i, start, end) for i in found]},
+                    params=connection_params(start, end, brand_ids, date, False),
+                ),
+                exchange(
+                    f"{API}/v2/main/eol_connections/search",
+                    [v3_connection(i, start, end) for i in found],
+                    method="POST",
+                    json={
+                        "start_id": start,
+                        "end_id": end,
+                        "departure_after": date.isoformat(),
+                        "only_direct": False,
+                        "allowed_brands": brand_ids,
+                    },
+                ),
+            ]
+    return exchanges
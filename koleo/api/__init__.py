@@ -1,2 +1,4 @@
 from .client import KoleoAPI
+from .metrics import MetricsRegistry, RequestMetrics
+from .replay import Recorder, ReplayServer
 from .types import *
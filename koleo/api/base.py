@@ -10,6 +10,8 @@ from aiohttp import (
 from orjson import loads
 
 from .logging import LoggingMixin
+from .metrics import MetricsRegistry, RequestMetrics
+from .replay import Recorder, ReplayServer
 
 
 class JsonableData(bytes):
@@ -28,24 +30,50 @@ class JsonableData(bytes):
 
 class BaseAPIClient(LoggingMixin):
     _session: ClientSession
+    metrics: MetricsRegistry | None = None
+    recorder: Recorder | None = None
+    replay: ReplayServer | None = None
 
     exc = ClientResponseError
 
     @property
     def session(self) -> "ClientSession":
         if not hasattr(self, "_session"):
-            self._session = ClientSession()
+            self._session = ClientSession(trace_configs=[self.metrics.trace_config()] if self.metrics else None)
         return self._session
 
     async def close(self):
+        if self.recorder:
+            self.recorder.save()
+        if self.replay:
+            await self.replay.stop()
         return await self.session.close()
 
     async def exc_getter(self, r: ClientResponse) -> Exception | None:
         return
 
-    async def request(self, method, url: str, *args, retries: int = 4, fail_wait: float = 8, **kwargs) -> JsonableData:
+    async def request(
+        self,
+        method,
+        url: str,
+        *args,
+        retries: int = 4,
+        fail_wait: float = 8,
+        _metrics: RequestMetrics | None = None,
+        **kwargs,
+    ) -> JsonableData:
+        if _metrics is None and self.metrics:
+            _metrics = self.metrics.start(method, url)
+        target = url
+        if self.replay:
+            await self.replay.start()
+            target = self.replay.rewrite(url)
         try:
-            async with self.session.request(method, url, *args, **kwargs) as r:
+            async with self.session.request(method, target, *args, trace_request_ctx=_metrics, **kwargs) as r:
+                if self.recorder:
+                    self.recorder.record(
+                        method, url, kwargs.get("params"), kwargs.get("json"), r.status, r.headers, await r.read()
+                    )
                 if not r.ok:
                     self.dl(r.headers)
                     try:
@@ -55,9 +83,14 @@ class BaseAPIClient(LoggingMixin):
                     if exc := (await self.exc_getter(r)):
                         raise exc
                     r.raise_for_status()
-                return JsonableData(await r.read(), response=r)
+                data = JsonableData(await r.read(), response=r)
+                if _metrics:
+                    _metrics.finish(len(data))
+                return data
         except (ClientConnectorError, ClientOSError) as e:
             if retries > 0:
+                if _metrics:
+                    _metrics.retries += 1
                 await asleep(fail_wait)
                 return await self.request(
                     method,
@@ -65,6 +98,13 @@ class BaseAPIClient(LoggingMixin):
                     *args,
                     retries=retries - 1,
                     fail_wait=fail_wait,
+                    _metrics=_metrics,
                     **kwargs,
                 )
+            if _metrics:
+                _metrics.finish(error=e)
+            raise e
+        except Exception as e:
+            if _metrics and _metrics.total is None:
+                _metrics.finish(error=e)
             raise e
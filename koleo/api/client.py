@@ -198,9 +198,7 @@ class KoleoAPI(BaseAPIClient):
             )
         ).json()
 
-    async def get_train_composition(
-        self, connection_id: int, train_nr: int, place_type: int
-    ) -> SeatsAvailabilityResponse:
+    async def get_train_composition(self, connection_id: int, train_nr: int, place_type: int) -> TrainComposition:
         # https://koleo.pl/api/v2/main/train_composition/connection_id/train_nr/place_type
         return (
             await self.get(
@@ -311,7 +309,7 @@ class KoleoAPI(BaseAPIClient):
     async def realtime_train_timetable(self, train_id: int, operating_day: datetime) -> RealtimeTrainTimetable:
         return (
             await self.get(
-                f"https://api.koleo.pl/v2/main/train_timetable/{train_id}/{operating_day}",
+                f"https://api.koleo.pl/v2/main/train_timetable/{train_id}/{operating_day.strftime("%Y-%m-%d")}",
                 use_auth=True,
             )
         ).json()
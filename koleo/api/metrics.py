@@ -0,0 +1,133 @@
+from asyncio import get_running_loop
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+
+from aiohttp import (
+    ClientSession,
+    TraceConfig,
+    TraceConnectionCreateEndParams,
+    TraceConnectionCreateStartParams,
+    TraceConnectionReuseconnParams,
+    TraceDnsCacheHitParams,
+    TraceDnsResolveHostEndParams,
+    TraceDnsResolveHostStartParams,
+    TraceRequestEndParams,
+    TraceRequestExceptionParams,
+    TraceRequestStartParams,
+)
+
+
+def now() -> float:
+    return get_running_loop().time()
+
+
+@dataclass
+class RequestMetrics:
+    method: str
+    url: str
+    started: float = field(default_factory=now)
+    # all durations are in seconds and only cover the last attempt, retries are counted separately
+    dns: float | None = None
+    connect: float | None = None  # tcp and tls, aiohttp doesn't split them
+    ttfb: float | None = None
+    download: float | None = None
+    total: float | None = None
+    status: int | None = None
+    size: int = 0
+    retries: int = 0
+    reused_connection: bool = False
+    error: str | None = None
+    _attempt_started: float = 0
+    _dns_started: float = 0
+    _connect_started: float = 0
+
+    def finish(self, size: int | None = None, error: Exception | None = None):
+        finished = now()
+        if size is not None:
+            self.size = size
+        if self.ttfb is not None:
+            self.download = finished - self._attempt_started - self.ttfb
+        if error is not None:
+            self.error = type(error).__name__
+        self.total = finished - self.started
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.requests: list[RequestMetrics] = []
+
+    def start(self, method: str, url: str) -> RequestMetrics:
+        metrics = RequestMetrics(method, url)
+        self.requests.append(metrics)
+        return metrics
+
+    def trace_config(self) -> TraceConfig:
+        # every callback gets the RequestMetrics passed as trace_request_ctx to session.request
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_dns_resolvehost_start.append(on_dns_start)
+        trace_config.on_dns_resolvehost_end.append(on_dns_end)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_connection_create_start.append(on_connect_start)
+        trace_config.on_connection_create_end.append(on_connect_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuse)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+
+def request_metrics(ctx: SimpleNamespace) -> RequestMetrics | None:
+    metrics = ctx.trace_request_ctx
+    return metrics if isinstance(metrics, RequestMetrics) else None
+
+
+async def on_request_start(session: ClientSession, ctx: SimpleNamespace, params: TraceRequestStartParams):
+    if metrics := request_metrics(ctx):
+        metrics._attempt_started = now()
+        metrics.dns = metrics.connect = metrics.ttfb = metrics.download = None
+        metrics.reused_connection = False
+        metrics.error = None
+
+
+async def on_dns_start(session: ClientSession, ctx: SimpleNamespace, params: TraceDnsResolveHostStartParams):
+    if metrics := request_metrics(ctx):
+        metrics._dns_started = now()
+
+
+async def on_dns_end(session: ClientSession, ctx: SimpleNamespace, params: TraceDnsResolveHostEndParams):
+    if metrics := request_metrics(ctx):
+        metrics.dns = now() - metrics._dns_started
+
+
+async def on_dns_cache_hit(session: ClientSession, ctx: SimpleNamespace, params: TraceDnsCacheHitParams):
+    if metrics := request_metrics(ctx):
+        metrics.dns = 0
+
+
+async def on_connect_start(session: ClientSession, ctx: SimpleNamespace, params: TraceConnectionCreateStartParams):
+    if metrics := request_metrics(ctx):
+        metrics._connect_started = now()
+
+
+async def on_connect_end(session: ClientSession, ctx: SimpleNamespace, params: TraceConnectionCreateEndParams):
+    # dns resolution happens inside connection creation, it's subtracted so the two don't overlap
+    if metrics := request_metrics(ctx):
+        metrics.connect = now() - metrics._connect_started - (metrics.dns or 0)
+
+
+async def on_connection_reuse(session: ClientSession, ctx: SimpleNamespace, params: TraceConnectionReuseconnParams):
+    if metrics := request_metrics(ctx):
+        metrics.connect = 0
+        metrics.reused_connection = True
+
+
+async def on_request_end(session: ClientSession, ctx: SimpleNamespace, params: TraceRequestEndParams):
+    # fired once the response headers are in, the body is read later by the client
+    if metrics := request_metrics(ctx):
+        metrics.ttfb = now() - metrics._attempt_started
+        metrics.status = params.response.status
+
+
+async def on_request_exception(session: ClientSession, ctx: SimpleNamespace, params: TraceRequestExceptionParams):
+    if metrics := request_metrics(ctx):
+        metrics.error = type(params.exception).__name__
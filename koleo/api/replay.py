@@ -0,0 +1,148 @@
+import gzip
+import typing as t
+from asyncio import Lock, sleep
+from collections.abc import Mapping
+from urllib.parse import urlsplit
+
+from aiohttp import web
+from orjson import OPT_SORT_KEYS, dumps, loads
+from yarl import URL
+
+
+# a recorded request and its response: method, url, params, json, status, headers and body
+Exchange = dict[str, t.Any]
+
+# fields carrying the time a search starts at, pagination moves them so they're ignored when nothing matches exactly
+VOLATILE_FIELDS = {"query[date]", "departure_after"}
+# the body is stored decoded, so these would describe the original transfer instead of the replayed one
+SKIPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+def split_url(url: str, params: t.Any = None) -> tuple[str, list[list[str]]]:
+    # the same encoding aiohttp uses for params, so recorded and replayed requests line up
+    parsed = URL(url)
+    if params:
+        parsed = parsed.extend_query(params)
+    return str(parsed.with_query(None)), [[k, v] for k, v in parsed.query.items()]
+
+
+def exchange_key(method: str, url: str, params: list[list[str]], json: t.Any, exact: bool = True) -> tuple:
+    if not exact:
+        params = [i for i in params if i[0] not in VOLATILE_FIELDS]
+        if isinstance(json, dict):
+            json = {k: v for k, v in json.items() if k not in VOLATILE_FIELDS}
+    return method, url, tuple(sorted(map(tuple, params))), dumps(json, option=OPT_SORT_KEYS)
+
+
+def load_archive(path: str) -> list[Exchange]:
+    # gzipped or plain, one exchange per line or a single json list
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    if data.lstrip()[:1] == b"[":
+        return loads(data)
+    return [loads(line) for line in data.splitlines() if line.strip()]
+
+
+def save_archive(path: str, exchanges: list[Exchange]):
+    data = b"".join(dumps(i) + b"\n" for i in exchanges)
+    with open(path, "wb") as f:
+        f.write(gzip.compress(data) if path.endswith(".gz") else data)
+
+
+class Recorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.exchanges: list[Exchange] = []
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        params: t.Any,
+        json: t.Any,
+        status: int,
+        headers: Mapping[str, str],
+        body: bytes,
+    ):
+        url, query = split_url(url, params)
+        self.exchanges.append(
+            {
+                "method": method,
+                "url": url,
+                "params": query,
+                "json": json,
+                "status": status,
+                "headers": {str(k): v for k, v in headers.items() if k.lower() not in SKIPPED_HEADERS},
+                "body": body.decode(errors="replace"),
+            }
+        )
+
+    def save(self):
+        save_archive(self.path, self.exchanges)
+
+
+class ReplayServer:
+    # urls are served as /<host>/<path> so one server stands in for both koleo.pl and api.koleo.pl
+    def __init__(self, exchanges: list[Exchange], latency: float = 0):
+        self.exchanges: dict[tuple, Exchange] = {}
+        for exchange in exchanges:
+            for exact in (True, False):
+                self.exchanges.setdefault(
+                    exchange_key(exchange["method"], exchange["url"], exchange["params"], exchange["json"], exact),
+                    exchange,
+                )
+        self.latency = latency
+        self.hits = 0
+        self.misses: list[str] = []
+        self.runner: web.AppRunner | None = None
+        self.url = ""
+        self._lock = Lock()
+
+    @classmethod
+    def load(cls, path: str, latency: float = 0) -> t.Self:
+        return cls(load_archive(path), latency)
+
+    def rewrite(self, url: str) -> str:
+        if url.startswith(self.url):
+            return url
+        parts = urlsplit(url)
+        return f"{self.url}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+
+    def find(self, method: str, url: str, params: list[list[str]], json: t.Any) -> Exchange | None:
+        return self.exchanges.get(exchange_key(method, url, params, json)) or self.exchanges.get(
+            exchange_key(method, url, params, json, exact=False)
+        )
+
+    async def handle(self, request: web.Request) -> web.Response:
+        url = f"https://{request.match_info["host"]}/{request.match_info["path"]}"
+        params = [[k, v] for k, v in request.query.items()]
+        json = loads(await request.read()) if request.can_read_body else None
+        if self.latency:
+            await sleep(self.latency)
+        if not (exchange := self.find(request.method, url, params, json)):
+            self.misses.append(f"{request.method} {url}")
+            return web.Response(status=404, text='{"error": "not recorded"}', content_type="application/json")
+        self.hits += 1
+        return web.Response(status=exchange["status"], body=exchange["body"].encode(), headers=exchange["headers"])
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        # requests started together all wait for the same server
+        async with self._lock:
+            if self.runner:
+                return self.url
+            app = web.Application()
+            app.router.add_route("*", "/{host}/{path:.*}", self.handle)
+            self.runner = web.AppRunner(app, access_log=None)
+            await self.runner.setup()
+            site = web.TCPSite(self.runner, host, port)
+            await site.start()
+            bound = self.runner.addresses[0]
+            self.url = f"http://{bound[0]}:{bound[1]}"
+            return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner, self.url = None, ""
@@ -1,15 +1,17 @@
+import sys
 from argparse import ArgumentParser
 from asyncio import run
 from datetime import datetime
 from inspect import isawaitable
 
-from .api import KoleoAPI
+from .api import KoleoAPI, MetricsRegistry, Recorder, ReplayServer
 from .cli import CLI
+from .profiling import Profiler, add_profile_arguments, profile_options
 from .storage import DEFAULT_CONFIG_PATH, Storage
 from .utils import RemainderString, parse_datetime, duplicate_parser
 
 
-def main():
+def run_cli():
     cli = CLI()
 
     parser = ArgumentParser("koleo", description="Koleo CLI")
@@ -17,6 +19,26 @@ def main():
     parser.add_argument("--ignore_cache", action="store_true", default=False)
 
     parser.add_argument("--nocolor", help="Disable color output and formatting", action="store_true", default=False)
+    parser.add_argument(
+        "--format",
+        help="output format, json and ndjson emit one record per train/connection/seat class",
+        choices=["text", "json", "ndjson"],
+        default="text",
+    )
+    parser.add_argument(
+        "--timings",
+        help="show per-request timings (dns/connect/ttfb/download) and cache hits after the command",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--record", help="write every request and response to an archive, gzipped if the path ends with .gz"
+    )
+    parser.add_argument("--replay", help="answer requests from an archive written by --record instead of koleo")
+    parser.add_argument(
+        "--replay_latency", help="simulated server latency in seconds for --replay", type=float, default=0
+    )
+    add_profile_arguments(parser)
     subparsers = parser.add_subparsers(title="actions", required=False)  # type: ignore
 
     departures = subparsers.add_parser(
@@ -36,8 +58,35 @@ def main():
         type=lambda s: parse_datetime(s),
         default=datetime.now(),
     )
+    departures.add_argument("--days", help="list departures for n consecutive days", type=int, default=None)
+    departures.add_argument(
+        "-u",
+        "--until",
+        help="only list departures up to this date",
+        type=lambda s: parse_datetime(s),
+        default=None,
+    )
     departures.add_argument("-s", "--save", help="save the station as your default one", action="store_true")
-    departures.set_defaults(func=cli.full_departures_view, pass_=["station", "date"])
+    departures.add_argument(
+        "-r",
+        "--realtime",
+        help="overlay realtime delays from the estimated timetable",
+        action="store_true",
+        default=False,
+    )
+    departures.add_argument(
+        "-w",
+        "--watch",
+        help="keep refreshing the board with realtime delays, ignores the date",
+        action="store_true",
+        default=False,
+    )
+    departures.add_argument("--interval", help="--watch refresh interval in seconds", type=float, default=30)
+    departures.add_argument("--limit", help="number of trains shown with --watch", type=int, default=15)
+    departures.set_defaults(
+        func=cli.full_departures_view,
+        pass_=["station", "date", "days", "until", "watch", "interval", "limit", "realtime"],
+    )
 
     arrivals = subparsers.add_parser(
         "arrivals", aliases=["a", "arr", "przyjazdy", "p"], help="Allows you to list station departures"
@@ -56,8 +105,23 @@ def main():
         type=lambda s: parse_datetime(s),
         default=datetime.now(),
     )
+    arrivals.add_argument("--days", help="list arrivals for n consecutive days", type=int, default=None)
+    arrivals.add_argument(
+        "-u",
+        "--until",
+        help="only list arrivals up to this date",
+        type=lambda s: parse_datetime(s),
+        default=None,
+    )
     arrivals.add_argument("-s", "--save", help="save the station as your default one", action="store_true")
-    arrivals.set_defaults(func=cli.full_arrivals_view, pass_=["station", "date"])
+    arrivals.add_argument(
+        "-r",
+        "--realtime",
+        help="overlay realtime delays from the estimated timetable",
+        action="store_true",
+        default=False,
+    )
+    arrivals.set_defaults(func=cli.full_arrivals_view, pass_=["station", "date", "days", "until", "realtime"])
 
     all_trains = subparsers.add_parser(
         "all", aliases=["w", "wszystkie", "all_trains", "pociagi"], help="Allows you to list all station trains"
@@ -77,7 +141,29 @@ def main():
         default=datetime.now(),
     )
     all_trains.add_argument("-s", "--save", help="save the station as your default one", action="store_true")
-    all_trains.set_defaults(func=cli.all_trains_view, pass_=["station", "date"])
+    all_trains.add_argument(
+        "-r",
+        "--realtime",
+        help="overlay realtime delays from the estimated timetable",
+        action="store_true",
+        default=False,
+    )
+    all_trains.set_defaults(func=cli.all_trains_view, pass_=["station", "date", "realtime"])
+
+    multi_departures = subparsers.add_parser(
+        "multidepartures",
+        aliases=["md", "multi", "zbiorcze"],
+        help="Allows you to list combined departures for multiple stations or a station group",
+    )
+    multi_departures.add_argument("stations", help="The station names or groups", nargs="+", type=str)
+    multi_departures.add_argument(
+        "-d",
+        "--date",
+        help="the departure date",
+        type=lambda s: parse_datetime(s),
+        default=datetime.now(),
+    )
+    multi_departures.set_defaults(func=cli.multi_departures_view, pass_=["stations", "date"])
 
     train_route = subparsers.add_parser(
         "trainroute",
@@ -103,7 +189,19 @@ def main():
     train_route.add_argument(
         "-s", "--show_stations", help="limit the result to A->B", action="extend", nargs=2, type=str, default=None
     )
-    train_route.set_defaults(func=cli.train_info_view, pass_=["brand", "name", "date", "closest", "show_stations"])
+    train_route.add_argument(
+        "-l", "--live", help="overlay realtime arrival and departure times", action="store_true", default=False
+    )
+    train_route.add_argument(
+        "-w",
+        "--watch",
+        help="keep tracking the train, polling more often when it's close to the next stop",
+        action="store_true",
+        default=False,
+    )
+    train_route.set_defaults(
+        func=cli.train_info_view, pass_=["brand", "name", "date", "closest", "show_stations", "live", "watch"]
+    )
 
     train_calendar = subparsers.add_parser(
         "traincalendar",
@@ -114,6 +212,28 @@ def main():
     train_calendar.add_argument("name", help="The train name", nargs="+", action=RemainderString)
     train_calendar.set_defaults(func=cli.train_calendar_view, pass_=["brand", "name"])
 
+    train_ids = subparsers.add_parser(
+        "trainids",
+        aliases=["ids", "tids"],
+        help="Resolves the train ids of many trains at once",
+    )
+    train_ids.add_argument("trains", help='The trains, each quoted as "BRAND NUMBER [NAME]"', nargs="+", type=str)
+    train_ids.add_argument(
+        "-d",
+        "--date",
+        help="the date",
+        type=lambda s: parse_datetime(s),
+        default=datetime.now(),
+    )
+    train_ids.add_argument(
+        "-c",
+        "--closest",
+        help="use the closest date each train runs on",
+        action="store_true",
+        default=False,
+    )
+    train_ids.set_defaults(func=cli.train_ids_view, pass_=["trains", "date", "closest"])
+
     train_detail = subparsers.add_parser(
         "traindetail",
         aliases=["td", "tid", "id", "idpoc"],
@@ -123,7 +243,17 @@ def main():
         "-s", "--show_stations", help="limit the result to A->B", action="extend", nargs=2, type=str, default=None
     )
     train_detail.add_argument("train_id", help="The koleo ID", type=int)
-    train_detail.set_defaults(func=cli.train_detail_view, pass_=["train_id", "show_stations"])
+    train_detail.add_argument(
+        "-l", "--live", help="overlay realtime arrival and departure times", action="store_true", default=False
+    )
+    train_detail.add_argument(
+        "-w",
+        "--watch",
+        help="keep tracking the train, polling more often when it's close to the next stop",
+        action="store_true",
+        default=False,
+    )
+    train_detail.set_defaults(func=cli.train_detail_view, pass_=["train_id", "show_stations", "live", "watch"])
 
     stations = subparsers.add_parser(
         "stations", aliases=["s", "find", "f", "stacje", "ls", "q"], help="Allows you to find stations by their name"
@@ -195,9 +325,43 @@ def main():
         type=int,
         default=1,
     )
+    connections.add_argument(
+        "-P",
+        "--parallel",
+        help="speculatively fetch n result pages in parallel, trims the result to --length",
+        type=int,
+        default=1,
+    )
+    connections.add_argument(
+        "--backend",
+        help="where to search: the koleo api or a local planner over the start, --via and destination boards, "
+        "which only finds journeys whose trains all call at one of those stations",
+        choices=["api", "local"],
+        default="api",
+    )
+    connections.add_argument(
+        "--via",
+        help="stations the journey has to pass through, local backend only",
+        action="extend",
+        nargs="+",
+        type=str,
+        default=[],
+    )
+    connections.add_argument(
+        "--min_transfer",
+        help="minimum transfer time in minutes, local backend only",
+        type=int,
+        default=5,
+    )
+    connections.add_argument(
+        "--snapshot",
+        help="plan over a snapshot built with `koleo snapshot build` instead of fetching boards, local backend only",
+        type=str,
+        default=None,
+    )
     connections.set_defaults(
         func=cli.connections_view,
-        pass_=["start", "end", "brands", "date", "direct", "include_prices", "only_purchasable", "length"],
+        pass_=["start", "end", "brands", "date", "direct", "include_prices", "only_purchasable", "length", "parallel"],
     )
     destination_connections = duplicate_parser(
         connections,
@@ -219,7 +383,64 @@ def main():
         "v3_connections",
         ["z3"],
         help="Allows you to search for connections from a to b using V3 Koleo Search",
-        defaults_overwrites={"func": cli.connections_view_v3},
+        defaults_overwrites={
+            "func": cli.connections_view_v3,
+            "pass_": [*connections.get_default("pass_"), "realtime"],
+        },
+    )
+    v3_connections.add_argument(
+        "-r",
+        "--realtime",
+        help="annotate the legs with realtime delays and flag transfers that won't work",
+        action="store_true",
+        default=False,
+    )
+
+    matrix = subparsers.add_parser(
+        "matrix",
+        aliases=["m", "macierz"],
+        help="Finds the fastest connection between every pair of the given stations",
+    )
+    matrix.add_argument("stations", help="The stations", nargs="+", type=str)
+    matrix.add_argument(
+        "-d",
+        "--date",
+        help="the date",
+        type=lambda s: parse_datetime(s),
+        default=datetime.now(),
+    )
+    matrix.add_argument("-b", "--brands", help="Brands to include", action="extend", nargs="+", type=str, default=[])
+    matrix.add_argument(
+        "-n",
+        "--direct",
+        help="whether the result should only include direct trains",
+        action="store_true",
+        default=False,
+    )
+    matrix.add_argument(
+        "-l",
+        "--length",
+        help="compare at least n connections per pair",
+        type=int,
+        default=3,
+    )
+    matrix.add_argument(
+        "-j",
+        "--concurrency",
+        help="how many pairs are searched at once",
+        type=int,
+        default=4,
+    )
+    matrix.add_argument(
+        "-o",
+        "--output",
+        help="append the results to a .csv or .ndjson file, pairs already in it are skipped",
+        type=str,
+        default=None,
+    )
+    matrix.set_defaults(
+        func=cli.connections_matrix_view,
+        pass_=["stations", "date", "brands", "direct", "length", "concurrency", "output"],
     )
 
     train_passenger_stats = subparsers.add_parser(
@@ -252,6 +473,71 @@ def main():
         func=cli.train_passenger_stats_view, pass_=["brand", "name", "date", "stations", "type", "detailed"]
     )
 
+    seatfinder = subparsers.add_parser(
+        "seatfinder",
+        aliases=["sf", "znajdz_miejsce"],
+        help="Finds the best free seats on a train",
+    )
+    seatfinder.add_argument("brand", help="The brand name", type=str)
+    seatfinder.add_argument("name", help="The train name", nargs="+", action=RemainderString)
+    seatfinder.add_argument(
+        "-d",
+        "--date",
+        help="the date",
+        type=lambda s: parse_datetime(s),
+        default=datetime.now(),
+    )
+    seatfinder.add_argument("-s", "--stations", help="A->B", action="extend", nargs=2, type=str, default=None)
+    seatfinder.add_argument("-t", "--type", help="limit the search to seats of a given type", type=str, required=False)
+    seatfinder.add_argument(
+        "-m",
+        "--mode",
+        help="fast returns the first seat matching every constraint, optimized ranks all free seats",
+        choices=["fast", "optimized"],
+        default="optimized",
+    )
+    seatfinder.add_argument("-w", "--window", help="prefer window seats", action="store_true", default=False)
+    seatfinder.add_argument(
+        "-c", "--compartment", help="prefer seats in empty compartments", action="store_true", default=False
+    )
+    seatfinder.add_argument(
+        "-p", "--pair", help="prefer seats with a free seat next to them", action="store_true", default=False
+    )
+    seatfinder.add_argument(
+        "-e", "--end", help="prefer carriages near this end of the train", choices=["front", "back"], default=None
+    )
+    seatfinder.add_argument(
+        "--allow_special",
+        help="include seats in special compartments (bikes, families, ...)",
+        action="store_true",
+        default=False,
+    )
+    seatfinder.add_argument("-l", "--limit", help="how many seats to show", type=int, default=5)
+    seatfinder.add_argument(
+        "--segments",
+        help="check every part of the journey separately, suggests seat changes when no seat is free throughout",
+        action="store_true",
+        default=False,
+    )
+    seatfinder.set_defaults(
+        func=cli.seatfinder_view,
+        pass_=[
+            "brand",
+            "name",
+            "date",
+            "stations",
+            "type",
+            "mode",
+            "window",
+            "compartment",
+            "pair",
+            "end",
+            "allow_special",
+            "limit",
+            "segments",
+        ],
+    )
+
     train_connection_stats = subparsers.add_parser(
         "trainconnectionstats",
         aliases=["tcs"],
@@ -288,6 +574,27 @@ def main():
     aliases_remove.add_argument("alias", help="The alias")
     aliases_remove.set_defaults(func=cli.alias_remove_view, pass_=["alias"])
 
+    snapshot = subparsers.add_parser("snapshot", help="Build and inspect offline timetable snapshots")
+    snapshot_subparser = snapshot.add_subparsers()
+    snapshot_build = snapshot_subparser.add_parser(
+        "build", aliases=["b"], help="crawl the boards of the given stations into a snapshot file"
+    )
+    snapshot_build.add_argument("stations", help="The stations to crawl", nargs="+", type=str)
+    snapshot_build.add_argument(
+        "-d",
+        "--date",
+        help="the first day",
+        type=lambda s: parse_datetime(s),
+        default=datetime.now(),
+    )
+    snapshot_build.add_argument("--days", help="number of days to crawl", type=int, default=1)
+    snapshot_build.add_argument("-o", "--output", help="the snapshot path", type=str, default="koleo-snapshot.bin")
+    snapshot_build.set_defaults(func=cli.snapshot_build_view, pass_=["stations", "date", "days", "output"])
+
+    snapshot_info = snapshot_subparser.add_parser("info", aliases=["i"], help="show what a snapshot contains")
+    snapshot_info.add_argument("path", help="The snapshot path", nargs="?", default="koleo-snapshot.bin")
+    snapshot_info.set_defaults(func=cli.snapshot_info_view, pass_=["path"])
+
     clear_cache = subparsers.add_parser(
         "clear_cache",
         help="Allows you to clear koleo-cli cache",
@@ -298,18 +605,34 @@ def main():
 
     storage = Storage.load(path=args.config, ignore_cache=args.ignore_cache)
     client = KoleoAPI()
+    if args.timings:
+        client.metrics = MetricsRegistry()
+    if args.record:
+        client.recorder = Recorder(args.record)
+    if args.replay:
+        client.replay = ReplayServer.load(args.replay, args.replay_latency)
 
     async def run_view(func, *args, **kwargs):
-        res = func(*args, **kwargs)
-        if isawaitable(res):
-            try:
-                await res
-            except SystemExit:
-                ...
-        await client.close()
+        # the recording, timings and replay misses are still written when the view fails
+        try:
+            res = func(*args, **kwargs)
+            if isawaitable(res):
+                try:
+                    await res
+                except SystemExit:
+                    ...
+        finally:
+            cli.finish_output()
+            await client.close()
+            if client.metrics:
+                cli.show_timings()
+            if client.replay and client.replay.misses:
+                sys.stderr.write(f"{len(client.replay.misses)} requests weren't in the replay archive:\n")
+                for miss in sorted(set(client.replay.misses)):
+                    sys.stderr.write(f"  {miss}\n")
 
     cli.client, cli.storage = client, storage
-    cli.init_console(args.nocolor)
+    cli.init_console(args.nocolor, args.format)
     if hasattr(args, "station") and args.station is None:
         if storage.favourite_station is None:
             raise ValueError("favourite_station is not set!")
@@ -321,6 +644,9 @@ def main():
     elif hasattr(args, "station") and getattr(args, "save", False):
         storage.favourite_station = args.station
         storage._dirty = True
+    if getattr(args, "backend", "api") == "local":
+        args.func = cli.local_connections_view
+        args.pass_ = ["start", "end", "date", "brands", "direct", "length", "via", "min_transfer", "snapshot"]
     if not hasattr(args, "func"):  # todo: fix
         if storage.favourite_station:
             run(run_view(cli.full_departures_view, storage.favourite_station, datetime.now()))
@@ -333,3 +659,11 @@ def main():
             run(run_view(args.func, **{k: v for k, v in args.__dict__.items() if k in getattr(args, "pass_", [])}))
     if storage.dirty:
         storage.save()
+
+
+def main():
+    options = profile_options(sys.argv[1:])
+    if not options.enabled and not options.stacks:
+        return run_cli()
+    with Profiler(options):
+        run_cli()
@@ -1,8 +1,11 @@
 from .aliases import Aliases
 from .connections import Connections
+from .matrix import Matrix
+from .planner import Planner
 from .seats import Seats
+from .snapshot import Snapshots
 from .station_board import StationBoard
 from .stations import Stations
 
 
-class CLI(Aliases, StationBoard, Connections, Seats, Stations): ...
+class CLI(Aliases, Planner, StationBoard, Matrix, Connections, Seats, Snapshots, Stations): ...
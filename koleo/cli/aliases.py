@@ -5,6 +5,9 @@ class Aliases(BaseCli):
     def alias_list_view(self):
         self.print("[bold][green]alias[/green] → [red]station[/red][/bold]:")
         for n, (k, v) in enumerate(self.storage.aliases.items()):
+            if self.machine_output:
+                self.emit({"alias": k, "station": v})
+                continue
             self.print(f"{n}. [bold][green]{k}[/green] → [red]{v}[/red][/bold]")
 
     async def alias_add_view(self, alias: str, station: str):
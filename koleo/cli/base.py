@@ -1,13 +1,48 @@
 import re
+import sys
+import typing as t
 from datetime import datetime
+from urllib.parse import urlsplit
+
+from orjson import dumps
 
 from koleo.api import KoleoAPI
-from koleo.api.types import ExtendedStationInfo, TrainOnStationInfo, TrainStop, TrainAttribute
+from koleo.api.types import (
+    EstimatedTrainTime,
+    ExtendedStationInfo,
+    RealtimeTrainStop,
+    TrainOnStationInfo,
+    TrainStop,
+    TrainAttribute,
+    TrainDetailResponse,
+)
 from koleo.storage import Storage
-from koleo.utils import convert_platform_number, koleo_time_to_dt, name_to_slug
+from koleo.utils import convert_platform_number, estimated_delay, koleo_time_to_dt, minutes_between, name_to_slug
 from .utils import GŁÓWNX_STATIONS
 
 
+OutputFormat = t.Literal["text", "json", "ndjson"]
+
+# train ids are per operating day, only today's schedule can still change noticeably
+TRAIN_TODAY_TTL = 300
+TRAIN_UNKNOWN_DAY_TTL = 3600
+TRAIN_TTL = 86400
+
+
+def format_seconds(seconds: float | None) -> str:
+    if seconds is None:
+        return "-"
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+
+def train_ttl(operating_day: datetime | str | None) -> int:
+    if operating_day is None:
+        return TRAIN_UNKNOWN_DAY_TTL
+    if isinstance(operating_day, str):
+        operating_day = datetime.strptime(operating_day[:10], "%Y-%m-%d")
+    return TRAIN_TODAY_TTL if operating_day.date() == datetime.now().date() else TRAIN_TTL
+
+
 class BaseCli:
     def __init__(
         self,
@@ -18,17 +53,27 @@ class BaseCli:
         self._client = client
         self._storage = storage
         self.no_color = no_color
+        self.output_format: OutputFormat = "text"
+        self._emitted = 0
+        # cleared when the estimates endpoints refuse the session, so the rest of the command skips them
+        self.realtime_available = True
 
-    def init_console(self, no_color: bool | None = None):
+    def init_console(self, no_color: bool | None = None, output_format: OutputFormat | None = None):
         if no_color is not None:
             self.no_color = no_color
-        if not self.no_color:
+        if output_format is not None:
+            self.output_format = output_format
+        if not self.no_color and not self.machine_output:
             from rich.console import Console
 
             self.console = Console(color_system="standard", highlight=False)
 
+    @property
+    def machine_output(self) -> bool:
+        return self.output_format != "text"
+
     def print(self, text: str, *args, **kwargs):
-        if not text.strip():
+        if not text.strip() or self.machine_output:
             return
         if self.no_color:
             result = re.sub(r"\[[^\]]*\]", "", text)
@@ -36,8 +81,63 @@ class BaseCli:
         else:
             self.console.print(text, *args, **kwargs)
 
+    def emit(self, record: dict[str, t.Any]):
+        # json/ndjson records are written straight to stdout, rich is never involved
+        if self.output_format == "ndjson":
+            sys.stdout.buffer.write(dumps(record) + b"\n")
+        elif self.output_format == "json":
+            sys.stdout.buffer.write((b"," if self._emitted else b"[") + dumps(record))
+        self._emitted += 1
+
+    def finish_output(self):
+        if self.output_format == "json":
+            sys.stdout.buffer.write(b"]\n" if self._emitted else b"[]\n")
+        sys.stdout.flush()
+
+    def show_timings(self):
+        # goes to stderr with json/ndjson so the records on stdout stay parseable
+        lines = []
+        if metrics := self.client.metrics:
+            requests = sorted(metrics.requests, key=lambda i: i.started)
+            finished = [i for i in requests if i.total is not None]
+            wall = max(i.started + i.total for i in finished) - min(i.started for i in finished) if finished else 0
+            lines.append(
+                f"[bold blue]{len(requests)} requests[/bold blue], {sum(i.retries for i in requests)} retries, {sum(i.size for i in requests) / 1024:.1f}KiB, {format_seconds(sum(i.total for i in finished))} in requests ({format_seconds(wall)} wall)"
+            )
+            width = max((len(urlsplit(i.url).path) for i in requests), default=0)
+            for i in requests:
+                status = f"[red]{i.error}[/red]" if i.error else f"[green]{i.status}[/green]"
+                lines.append(
+                    f"  {i.method} {urlsplit(i.url).path:<{width}} {status} dns {format_seconds(i.dns)} connect {format_seconds(i.connect)} ttfb {format_seconds(i.ttfb)} download {format_seconds(i.download)} [bold]total {format_seconds(i.total)}[/bold] {i.size / 1024:.1f}KiB"
+                    + (f" [red]{i.retries} retries[/red]" if i.retries else "")
+                )
+        if stats := self.storage.cache_stats:
+            lines.append(
+                "[bold blue]cache[/bold blue] "
+                + ", ".join(f"{kind} {hits}/{hits + misses}" for kind, (hits, misses) in stats.items())
+                + " hits"
+            )
+        if self.machine_output:
+            sys.stderr.write(re.sub(r"\[[^\]]*\]", "", "\n".join(lines)) + "\n")
+        else:
+            self.print("\n".join(lines))
+
+    def warn(self, text: str):
+        if self.machine_output:
+            sys.stderr.write(re.sub(r"\[[^\]]*\]", "", text) + "\n")
+        else:
+            self.print(f"[yellow]{text}[/yellow]")
+
+    def realtime_unavailable(self):
+        if self.realtime_available:
+            self.realtime_available = False
+            self.warn("Realtime data needs a logged in session, showing the timetable instead.")
+
     async def error_and_exit(self, text: str, *args, **kwargs):
-        self.print(f"[bold red]{text}[/bold red]", *args, **kwargs)
+        if self.machine_output:
+            sys.stderr.write(re.sub(r"\[[^\]]*\]", "", text) + "\n")
+        else:
+            self.print(f"[bold red]{text}[/bold red]", *args, **kwargs)
         await self.client.close()
         exit(2)
 
@@ -65,29 +165,78 @@ class BaseCli:
         return dt.strftime("%H:%M:%S") if self.storage.show_seconds else dt.strftime("%H:%M")
 
     async def trains_on_station_table(
-        self, trains: list[TrainOnStationInfo], type: int = 1, show_connection_id: bool | None = None
+        self,
+        trains: list[TrainOnStationInfo],
+        type: int = 1,
+        show_connection_id: bool | None = None,
+        show_date: bool = False,
+        estimates: dict[int, EstimatedTrainTime] | None = None,
     ):
         show_connection_id = self.storage.show_connection_id if show_connection_id is None else show_connection_id
         brands = await self.get_brands()
         for train in trains:
             time, color = (train["departure"], "green") if type == 1 else (train["arrival"], "yellow")
             assert time
-            dt = koleo_time_to_dt(time)
             brand = next(iter(i for i in brands if i["id"] == train["brand_id"]), {}).get("logo_text")
+            estimate = estimates.get(train["stations"][0]["train_id"]) if estimates else None
+            if self.machine_output:
+                self.emit(self.train_on_station_record(train, type, brand, estimate))
+                continue
+            dt = koleo_time_to_dt(time)
             tid = (f"{train["stations"][0]["train_id"]} ") if show_connection_id else ""
+            date_part = f"{dt.strftime("%d-%m")} " if show_date else ""
+            delay_part = f" [bold red]+{delay}[/bold red]" if (delay := estimated_delay(estimate, type)) else ""
             self.print(
-                f"{tid}[bold {color}]{self.ftime(dt)}[/bold {color}] [red]{brand}[/red] {train["train_full_name"]}[purple] {train["stations"][0]["name"]} {self.format_position(train["platform"], train["track"])}[/purple]"
+                f"{tid}[bold {color}]{date_part}{self.ftime(dt)}[/bold {color}]{delay_part} [red]{brand}[/red] {train["train_full_name"]}[purple] {train["stations"][0]["name"]} {self.format_position(train["platform"], train["track"])}[/purple]"
             )
 
-    def train_route_table(self, stops: list[TrainStop]):
+    def train_on_station_record(
+        self, train: TrainOnStationInfo, type: int, brand: str | None, estimate: EstimatedTrainTime | None = None
+    ) -> dict[str, t.Any]:
+        return {
+            "type": "departure" if type == 1 else "arrival",
+            "time": train["departure"] if type == 1 else train["arrival"],
+            "train_id": train["stations"][0]["train_id"],
+            "train_full_name": train["train_full_name"],
+            "brand_id": train["brand_id"],
+            "brand": brand,
+            "station_id": train["stations"][0]["id"],
+            "station": train["stations"][0]["name"],
+            "platform": train["platform"],
+            "track": train["track"],
+            "delay": estimated_delay(estimate, type),
+        }
+
+    def train_route_table(self, stops: list[TrainStop], realtime: dict[int, RealtimeTrainStop] | None = None):
         last_real_distance = stops[0]["distance"]
         for stop in stops:
-            arr = koleo_time_to_dt(stop["arrival"])
-            dep = koleo_time_to_dt(stop["departure"])
-            distance = stop["distance"] - last_real_distance
-            self.print(
-                f"[white underline]{distance / 1000:^5.1f}km[/white underline] [bold green]{self.ftime(arr)}[/bold green] - [bold red]{self.ftime(dep)}[/bold red] [purple]{stop["station_display_name"]} {self.format_position(stop["platform"])} [/purple]"
+            stop_realtime = realtime.get(stop["station_id"]) if realtime else None
+            self.print(self.train_route_row(stop, last_real_distance, stop_realtime))
+
+    def train_route_row(self, stop: TrainStop, start_distance: int, realtime: RealtimeTrainStop | None = None) -> str:
+        arr = koleo_time_to_dt(stop["arrival"])
+        dep = koleo_time_to_dt(stop["departure"])
+        distance = stop["distance"] - start_distance
+        arr_delay = dep_delay = ""
+        if realtime:
+            arr_delay = self.format_realtime_delay(
+                realtime["arrival"],
+                realtime["actual_arrival"] or realtime["expected_arrival"],
+                realtime["actual_arrival"],
             )
+            dep_delay = self.format_realtime_delay(
+                realtime["departure"],
+                realtime["actual_departure"] or realtime["expected_departure"],
+                realtime["actual_departure"],
+            )
+        return f"[white underline]{distance / 1000:^5.1f}km[/white underline] [bold green]{self.ftime(arr)}[/bold green]{arr_delay} - [bold red]{self.ftime(dep)}[/bold red]{dep_delay} [purple]{stop["station_display_name"]} {self.format_position(stop["platform"])} [/purple]"
+
+    def format_realtime_delay(self, scheduled: str, estimated: str | None, actual: str | None) -> str:
+        if (delay := minutes_between(scheduled, estimated)) is None:
+            return ""
+        # recorded times are shown in bold, estimates aren't
+        style = ("bold red" if delay > 0 else "bold green") if actual else ("red" if delay > 0 else "green")
+        return f" [{style}]{"+" if delay >= 0 else ""}{delay}[/{style}]"
 
     def format_position(self, platform: str, track: str | None = None):
         res = str(convert_platform_number(platform) or "" if not self.storage.use_roman_numerals else platform)
@@ -120,11 +269,17 @@ class BaseCli:
     async def get_brands(self):
         return self.storage.get_cache("brands") or self.storage.set_cache("brands", await self.client.get_brands())
 
+    async def get_train(self, train_id: int, operating_day: datetime | str | None = None) -> TrainDetailResponse:
+        cache_id = f"tr-{train_id}"
+        return self.storage.get_cache(cache_id) or self.storage.set_cache(
+            cache_id, await self.client.get_train(train_id), ttl=train_ttl(operating_day)
+        )
+
     async def get_station_by_id(self, id: int):
         key = f"st-{id}"
         return self.storage.get_cache(key) or self.storage.set_cache(key, await self.client.get_station_by_id(id))
 
-    async def get_brand_by_shortcut(self, s: str, *, name: str | None = None):
+    async def find_brand_by_shortcut(self, s: str, *, name: str | None = None) -> str | None:
         brands = await self.get_brands()
         s = s.upper()
         if name and "SŁONECZNY" in name and s == "KM":
@@ -132,12 +287,14 @@ class BaseCli:
         if s == "AR":
             return "ARRIVARP"
         if s not in [i["name"] for i in brands]:
-            res = {i["logo_text"]: i["name"] for i in brands}.get(s)
-            if not res:
-                await self.error_and_exit(f"Invalid brand name not found: [underline]{s},[/underline]")
-            return res
+            return {i["logo_text"]: i["name"] for i in brands}.get(s)
         return s
 
+    async def get_brand_by_shortcut(self, s: str, *, name: str | None = None) -> str:
+        if not (res := await self.find_brand_by_shortcut(s, name=name)):
+            await self.error_and_exit(f"Invalid brand name not found: [underline]{s.upper()},[/underline]")
+        return res
+
     async def get_train_attributes(self) -> dict[str, TrainAttribute]:
         if not (train_attributes := self.storage.get_cache("train_attributes")):
             train_attributes = {str(i["id"]): i for i in await self.client.get_train_attributes()}
@@ -1,20 +1,65 @@
+import typing as t
 from asyncio import gather
 from datetime import datetime, timedelta
+from time import time
 
 from koleo.api.types import (
     ConnectionDetail,
+    EstimatedTrainLeg,
     V3ConnectionResult,
     V3ConnectionLeg,
     TrainAttribute,
     ApiBrand,
     ExtendedStationInfo,
+    Price,
+    V3Price,
 )
-from koleo.utils import koleo_time_to_dt
+from koleo.utils import koleo_time_to_dt, minutes_between
 
 from .base import BaseCli
 from .utils import format_price
 
 
+CONNECTION_ESTIMATES_TTL = 60
+# the search returns connections departing up to 30 minutes before the requested date
+SEARCH_LOOKBEHIND = timedelta(minutes=30)
+PAGE_OVERLAP = SEARCH_LOOKBEHIND + timedelta(seconds=1)
+CONNECTIONS_TTL = 300
+PRICES_TTL = 300
+# speculative windows are staggered slightly tighter than a page so they overlap instead of leaving gaps
+SPECULATIVE_STAGGER = 0.8
+DEFAULT_PAGE_SPAN = timedelta(hours=2)
+
+C = t.TypeVar("C", ConnectionDetail, V3ConnectionResult)
+
+LegDelays = tuple[int | None, int | None]
+
+
+def connection_realtime(
+    connection: V3ConnectionResult, estimates: dict[tuple[int, int], EstimatedTrainLeg]
+) -> tuple[dict[int, LegDelays], list[int]]:
+    # returns departure/arrival delays per leg index and the indexes of legs whose transfer won't work
+    delays: dict[int, LegDelays] = {}
+    broken: list[int] = []
+    previous_arrival: datetime | None = None
+    required = timedelta()
+    for n, leg in enumerate(connection["legs"]):
+        if leg["leg_type"] == "walk_leg":
+            required += timedelta(minutes=leg["footpath_duration"])
+            continue
+        if leg["leg_type"] != "train_leg":
+            continue
+        estimate = estimates.get((leg["train_id"], leg["origin_station_id"]))
+        origin_call = estimate["origin_call"] if estimate else None
+        destination_call = estimate["destination_call"] if estimate else None
+        delays[n] = (minutes_between(leg["departure"], origin_call), minutes_between(leg["arrival"], destination_call))
+        departure = datetime.fromisoformat(origin_call or leg["departure"])
+        if previous_arrival and previous_arrival + required > departure:
+            broken.append(n)
+        previous_arrival, required = datetime.fromisoformat(destination_call or leg["arrival"]), timedelta()
+    return delays, broken
+
+
 class Connections(BaseCli):
     async def connections_view(
         self,
@@ -26,6 +71,7 @@ class Connections(BaseCli):
         include_prices: bool,
         only_purchasable: bool,
         length: int = 1,
+        parallel: int = 1,
     ):
         start_station, end_station, api_brands = await gather(
             self.get_station(start), self.get_station(end), self.get_brands()
@@ -41,25 +87,23 @@ class Connections(BaseCli):
             }
             if not connection_brands:
                 await self.error_and_exit(f'No brands match: [underline]{", ".join(brands)}[/underline]')
-        results: list[ConnectionDetail] = []
-        fetch_date = date
-        while len(results) < length:
-            connections = await self.client.get_connections(
-                start_station["name_slug"],
-                end_station["name_slug"],
+        results = await self.search_connection_pages(
+            lambda fetch_date: self.get_connections(
+                start_station,
+                end_station,
                 list(connection_brands.values()),
                 fetch_date,
                 direct,
                 only_purchasable,
-            )
-            if connections:
-                fetch_date = koleo_time_to_dt(connections[-1]["departure"]) + timedelta(seconds=(30 * 60) + 1)  # wtf
-                results.extend(connections)
-            else:
-                break
+            ),
+            date,
+            length,
+            "id",
+            parallel,
+        )
         if include_prices:
             res = await gather(
-                *(self.client.get_price(i["id"]) for i in results),
+                *(self.get_price(i["id"]) for i in results),
             )
             price_dict = {k: v for k, v in zip((i["id"] for i in results), res)}
         else:
@@ -74,6 +118,9 @@ class Connections(BaseCli):
         ]
 
         for i in results:
+            if self.machine_output:
+                self.emit({**i, "price": price_dict.get(i["id"])})
+                continue
             arr = koleo_time_to_dt(i["arrival"])
             dep = koleo_time_to_dt(i["departure"])
             travel_time = int((arr - dep).total_seconds())
@@ -159,6 +206,7 @@ class Connections(BaseCli):
         include_prices: bool,
         only_purchasable: bool,
         length: int = 1,
+        parallel: int = 1,
     ):
         include_prices = include_prices or only_purchasable
         start_station, end_station, api_brands = await gather(
@@ -175,35 +223,27 @@ class Connections(BaseCli):
             }
             if not connection_brands:
                 await self.error_and_exit(f'No brands match: [underline]{", ".join(brands)}[/underline]')
-        results: list[V3ConnectionResult] = []
-        fetch_date = date
-        while len(results) < length:
-            connections = await self.client.v3_connection_search(
-                start_station["id"],
-                end_station["id"],
+        results = await self.search_connection_pages(
+            lambda fetch_date: self.v3_connection_search(
+                start_station,
+                end_station,
                 list(connection_brands.values()),
                 fetch_date,
                 direct,
-            )
-            if connections:
-                fetch_date = koleo_time_to_dt(connections[-1]["departure"]) + timedelta(seconds=(30 * 60) + 1)  # wtf
-                results.extend(connections)
-            else:
-                break
+            ),
+            date,
+            length,
+            "uuid",
+            parallel,
+        )
 
         results = results[:3]
-        res = res = await gather(
-            *(self.get_connection_detail(i["uuid"]) for i in results),
+        # details and prices are resolved together, one wave for all connections
+        res = await gather(
+            *(self.get_connection_detail_and_price(i["uuid"], include_prices) for i in results),
         )
-        v2_results = {k: v for k, v in zip((i["uuid"] for i in results), res) if v is not None}
-
-        if include_prices:
-            res = await gather(
-                *(self.client.v3_get_price(i["uuid"]) for i in results),
-            )
-            price_dict = {k: v for k, v in zip((i["uuid"] for i in results), res) if v is not None}
-        else:
-            price_dict = {}
+        v2_results = {k: detail for k, (detail, _) in zip((i["uuid"] for i in results), res) if detail is not None}
+        price_dict = {k: price for k, (_, price) in zip((i["uuid"] for i in results), res) if price is not None}
         link = (
             f"https://koleo.pl/rozklad-pkp/{start_station["name_slug"]}/{end_station["name_slug"]}"
             + f"/{date.strftime("%d-%m-%Y_%H:%M")}"
@@ -226,6 +266,9 @@ class Connections(BaseCli):
                 continue
             else:
                 price_str = ""
+            if self.machine_output:
+                self.emit({**i, "uuid": j["uuid"], "price": price})
+                continue
             parts.append(
                 f"[bold green][link=https://koleo.pl/connection/{j["uuid"]}]{date_part}{self.ftime(dep)} - {date_part_2}{self.ftime(arr)}[/bold green] {travel_time//3600}h{(travel_time % 3600)/60:.0f}m {i['distance']}km{price_str}:[/link]"
             )
@@ -302,6 +345,8 @@ class Connections(BaseCli):
         include_prices: bool,
         only_purchasable: bool,
         length: int = 1,
+        parallel: int = 1,
+        realtime: bool = False,
     ):
         include_prices = include_prices or only_purchasable
         start_station, end_station, api_brands, train_attributes, stations = await gather(
@@ -322,28 +367,27 @@ class Connections(BaseCli):
             }
             if not connection_brands:
                 await self.error_and_exit(f'No brands match: [underline]{", ".join(brands)}[/underline]')
-        results: list[V3ConnectionResult] = []
-        fetch_date = date
-        while len(results) < length:
-            connections = await self.client.v3_connection_search(
-                start_station["id"],
-                end_station["id"],
+        results = await self.search_connection_pages(
+            lambda fetch_date: self.v3_connection_search(
+                start_station,
+                end_station,
                 list(connection_brands.values()),
                 fetch_date,
                 direct,
-            )
-            if connections:
-                fetch_date = koleo_time_to_dt(connections[-1]["departure"]) + timedelta(seconds=(30 * 60) + 1)  # wtf
-                results.extend(connections)
-            else:
-                break
+            ),
+            date,
+            length,
+            "uuid",
+            parallel,
+        )
         if include_prices:
             res = await gather(
-                *(self.client.v3_get_price(i["uuid"]) for i in results),
+                *(self.get_v3_price(i["uuid"]) for i in results),
             )
             price_dict = {k: v for k, v in zip((i["uuid"] for i in results), res) if v is not None}
         else:
             price_dict = {}
+        estimates = await self.get_connections_estimates([i["uuid"] for i in results]) if realtime else {}
         link = (
             f"https://koleo.pl/rozklad-pkp/{start_station["name_slug"]}/{end_station["name_slug"]}"
             + f"/{date.strftime("%d-%m-%Y_%H:%M")}"
@@ -354,6 +398,7 @@ class Connections(BaseCli):
         ]
 
         for i in results:
+            delays, broken = connection_realtime(i, estimates[i["uuid"]]) if realtime else ({}, [])
             arr = koleo_time_to_dt(i["arrival"])
             dep = koleo_time_to_dt(i["departure"])
             travel_time = int((arr - dep).total_seconds())
@@ -365,6 +410,18 @@ class Connections(BaseCli):
                 continue
             else:
                 price_str = ""
+            if self.machine_output:
+                record = {**i, "price": price}
+                if realtime:
+                    record["realtime"] = {
+                        "legs": [
+                            {"leg": n, "departure_delay": dep_delay, "arrival_delay": arr_delay}
+                            for n, (dep_delay, arr_delay) in delays.items()
+                        ],
+                        "broken_transfers": [i["legs"][n]["origin_station_id"] for n in broken],
+                    }
+                self.emit(record)
+                continue
             parts.append(
                 f"[bold green][link=https://koleo.pl/connection/{i["uuid"]}]{date_part}{self.ftime(dep)} - {date_part_2}{self.ftime(arr)}[/bold green] {travel_time//3600}h{(travel_time % 3600)/60:.0f}m{price_str}:[/link]"
             )
@@ -373,10 +430,14 @@ class Connections(BaseCli):
                     f" [bold red]- {train_attributes[str(constriction["attribute_definition_id"])]["name"]}: {constriction["annotation"]}[/bold red]"
                 )
             if len(i["legs"]) == 1 and not i["constrictions"]:
-                parts[-1] += " " + self.format_leg(i["legs"][0], api_brands, stations)
+                parts[-1] += " " + self.format_leg(i["legs"][0], api_brands, stations, delays.get(0))
             else:
-                for leg in i["legs"]:
-                    parts.append("  " + self.format_leg(leg, api_brands, stations))
+                for n, leg in enumerate(i["legs"]):
+                    if n in broken:
+                        parts.append(
+                            f"  [bold red]! transfer at {stations[str(leg["origin_station_id"])]["name"]} will likely be missed[/bold red]"
+                        )
+                    parts.append("  " + self.format_leg(leg, api_brands, stations, delays.get(n)))
 
         self.print("\n".join(parts))
 
@@ -385,6 +446,7 @@ class Connections(BaseCli):
         leg: V3ConnectionLeg,
         api_brands: list[ApiBrand],
         stations: dict[str, ExtendedStationInfo],
+        delays: LegDelays | None = None,
     ) -> str:
         if leg["leg_type"] == "walk_leg":
             return f"[yellow underline]WALK[/yellow underline] {leg["footpath_duration"]//60}h{(leg["footpath_duration"] % 60):.0f}m from [purple]{stations[str(leg["origin_station_id"])]['name']}[/purple] to [purple]{stations[str(leg["destination_station_id"])]['name']}[/purple]"
@@ -394,12 +456,13 @@ class Connections(BaseCli):
             fs = leg["stops_in_leg"][0]
             fs_station = stations[str(fs["station_id"])]
             fs_dep = koleo_time_to_dt(fs["departure"])
-            fs_info = f"[bold green]{self.ftime(fs_dep)} [/bold green][purple]{fs_station['name']} {self.format_position(fs["platform"], fs["track"])}[/purple]"
+            dep_delay, arr_delay = delays or (None, None)
+            fs_info = f"[bold green]{self.ftime(fs_dep)} [/bold green]{self.format_delay(dep_delay)}[purple]{fs_station['name']} {self.format_position(fs["platform"], fs["track"])}[/purple]"
 
             ls = leg["stops_in_leg"][-1]
             ls_station = stations[str(ls["station_id"])]
             ls_arr = koleo_time_to_dt(ls["arrival"])
-            ls_info = f"[bold green]{self.ftime(ls_arr)} [/bold green][purple]{ls_station['name']} {self.format_position(ls["platform"], ls["track"])}[/purple]"
+            ls_info = f"[bold green]{self.ftime(ls_arr)} [/bold green]{self.format_delay(arr_delay)}[purple]{ls_station['name']} {self.format_position(ls["platform"], ls["track"])}[/purple]"
 
             return f"[red]{brand}[/red] {leg["train_full_name"]} {fs_info} - {ls_info}"
         elif leg["leg_type"] == "station_change_leg":
@@ -407,6 +470,152 @@ class Connections(BaseCli):
         else:
             return f"Unknown leg: {leg}"
 
+    async def get_connections(
+        self,
+        start: ExtendedStationInfo,
+        end: ExtendedStationInfo,
+        brand_ids: list[int],
+        date: datetime,
+        direct: bool,
+        purchasable: bool,
+    ) -> list[ConnectionDetail]:
+        cache_id = f"conn-{start["id"]}-{end["id"]}-{"-".join(map(str, sorted(brand_ids)))}-{direct:d}{purchasable:d}"
+        return await self.get_cached_connection_page(
+            cache_id,
+            date,
+            lambda: self.client.get_connections(
+                start["name_slug"], end["name_slug"], brand_ids, date, direct, purchasable
+            ),
+        )
+
+    async def v3_connection_search(
+        self,
+        start: ExtendedStationInfo,
+        end: ExtendedStationInfo,
+        brand_ids: list[int],
+        date: datetime,
+        direct: bool,
+    ) -> list[V3ConnectionResult]:
+        cache_id = f"v3conn-{start["id"]}-{end["id"]}-{"-".join(map(str, sorted(brand_ids)))}-{direct:d}"
+        return await self.get_cached_connection_page(
+            cache_id, date, lambda: self.client.v3_connection_search(start["id"], end["id"], brand_ids, date, direct)
+        )
+
+    async def get_cached_connection_page(
+        self, cache_id: str, date: datetime, search: t.Callable[[], t.Awaitable[list[C]]]
+    ) -> list[C]:
+        # pages are bucketed per day, a later date inside an already fetched page is served from it
+        cache_id += f"-{date.strftime("%Y-%m-%d")}"
+        now, ts = time(), date.timestamp()
+        pages = [i for i in self.storage.get_cache(cache_id) or [] if i["fetched"] + CONNECTIONS_TTL > now]
+        for page in pages:
+            if page["from"] <= ts <= page["to"] + SEARCH_LOOKBEHIND.total_seconds():
+                lookbehind = ts - SEARCH_LOOKBEHIND.total_seconds()
+                if connections := [
+                    i for i in page["connections"] if koleo_time_to_dt(i["departure"]).timestamp() >= lookbehind
+                ]:
+                    return connections
+        connections = await search()
+        if connections:
+            last = koleo_time_to_dt(connections[-1]["departure"]).timestamp()
+            pages.append({"from": ts, "to": last, "fetched": now, "connections": connections})
+            self.storage.set_cache(cache_id, pages, ttl=CONNECTIONS_TTL)
+        return connections
+
+    async def search_connection_pages(
+        self,
+        search: t.Callable[[datetime], t.Awaitable[list[C]]],
+        date: datetime,
+        length: int,
+        id_key: t.Literal["id", "uuid"],
+        parallel: int = 1,
+    ) -> list[C]:
+        results: list[C] = []
+        fetch_date = date
+        if parallel <= 1:
+            while len(results) < length:
+                connections = await search(fetch_date)
+                if connections:
+                    fetch_date = koleo_time_to_dt(connections[-1]["departure"]) + PAGE_OVERLAP  # wtf
+                    results.extend(connections)
+                else:
+                    break
+            return results
+
+        # the first page is needed to guess how much time a single page covers
+        found: dict[t.Any, C] = {}
+        windows = [fetch_date]
+        span = DEFAULT_PAGE_SPAN
+        while True:
+            pages = await gather(*(search(i) for i in windows))
+            covered, exhausted = fetch_date, False
+            for start, page in zip(windows, pages):
+                found.update({i[id_key]: i for i in page})
+                # only a chain of overlapping windows guarantees no connection was skipped
+                if start > covered or exhausted:
+                    continue
+                if not page:
+                    exhausted = True
+                    continue
+                first, last = koleo_time_to_dt(page[0]["departure"]), koleo_time_to_dt(page[-1]["departure"])
+                covered = last + PAGE_OVERLAP
+                span = max(last - first, timedelta(minutes=15))
+            ordered = sorted(found.values(), key=lambda i: koleo_time_to_dt(i["departure"]))
+            complete = [i for i in ordered if exhausted or koleo_time_to_dt(i["departure"]) < covered]
+            if exhausted or len(complete) >= length:
+                return complete[:length]
+            fetch_date = covered
+            windows = [fetch_date + span * SPECULATIVE_STAGGER * n for n in range(parallel)]
+
+    def format_delay(self, delay: int | None) -> str:
+        if delay is None:
+            return ""
+        return f"[bold red]+{delay} [/bold red]" if delay > 0 else "[green]+0 [/green]"
+
+    async def get_connection_estimates(self, uuid: str) -> dict[tuple[int, int], EstimatedTrainLeg]:
+        if not self.realtime_available:
+            return {}
+        cache_id = f"cest-{uuid}"
+        if (legs := self.storage.get_cache(cache_id)) is None:
+            try:
+                res = await self.client.get_connection_estimated_train_times(uuid)
+            except self.client.errors.KoleoNotFound:
+                res = []
+            except (self.client.errors.KoleoUnauthorized, self.client.errors.AuthRequired):
+                # not cached, the estimates show up once there's a session
+                self.realtime_unavailable()
+                return {}
+            responses = res if isinstance(res, list) else [res]
+            legs = [leg for response in responses for leg in response["train_legs"]]
+            self.storage.set_cache(cache_id, legs, ttl=CONNECTION_ESTIMATES_TTL)
+        return {(i["train_id"], i["origin_station_id"]): i for i in legs}
+
+    async def get_connections_estimates(self, uuids: list[str]) -> dict[str, dict[tuple[int, int], EstimatedTrainLeg]]:
+        return dict(zip(uuids, await gather(*(self.get_connection_estimates(i) for i in uuids))))
+
     async def get_connection_detail(self, id: str) -> ConnectionDetail:
         connection_id = await self.client.v3_get_connection_id(id)
         return await self.client.get_connection(connection_id)
+
+    async def get_connection_detail_and_price(
+        self, id: str, include_price: bool
+    ) -> tuple[ConnectionDetail, V3Price | None]:
+        if not include_price:
+            return await self.get_connection_detail(id), None
+        detail, price = await gather(self.get_connection_detail(id), self.get_v3_price(id))
+        return detail, price
+
+    async def get_price(self, connection_id: int) -> Price | None:
+        cache_id = f"price-{connection_id}"
+        # wrapped so that connections without a price are cached as well
+        if (cached := self.storage.get_cache(cache_id)) is None:
+            cached = self.storage.set_cache(
+                cache_id, {"price": await self.client.get_price(connection_id)}, ttl=PRICES_TTL
+            )
+        return cached["price"]
+
+    async def get_v3_price(self, id: str) -> V3Price | None:
+        cache_id = f"v3price-{id}"
+        if (cached := self.storage.get_cache(cache_id)) is None:
+            cached = self.storage.set_cache(cache_id, {"price": await self.client.v3_get_price(id)}, ttl=PRICES_TTL)
+        return cached["price"]
@@ -0,0 +1,122 @@
+import csv
+import typing as t
+from asyncio import Semaphore, as_completed, gather
+from datetime import datetime
+from itertools import permutations
+from os.path import exists
+
+from orjson import dumps, loads
+
+from koleo.api.types import ExtendedStationInfo
+
+from .connections import Connections
+
+
+MATRIX_FIELDS = [
+    "origin_id",
+    "origin",
+    "destination_id",
+    "destination",
+    "departure",
+    "arrival",
+    "duration",
+    "changes",
+    "uuid",
+]
+
+
+# both are appended to row by row, which is what makes resuming an interrupted run possible
+MATRIX_OUTPUT_EXTENSIONS = (".csv", ".ndjson")
+
+
+def read_matrix_rows(path: str) -> list[dict[str, t.Any]]:
+    if not exists(path):
+        return []
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            return list(csv.DictReader(f))
+        return [loads(line) for line in f if line.strip()]
+
+
+class Matrix(Connections):
+    async def connections_matrix_view(
+        self,
+        stations: list[str],
+        date: datetime,
+        brands: list[str],
+        direct: bool,
+        length: int = 3,
+        concurrency: int = 4,
+        output: str | None = None,
+    ):
+        if output and not output.endswith(MATRIX_OUTPUT_EXTENSIONS):
+            await self.error_and_exit(f"The matrix can only be saved to {" or ".join(MATRIX_OUTPUT_EXTENSIONS)} files")
+        resolved = list({i["id"]: i for i in await gather(*(self.get_station(i) for i in stations))}.values())
+        if len(resolved) < 2:
+            await self.error_and_exit("A matrix needs at least two different stations")
+        api_brands = await self.get_brands()
+        brands = [i.lower().strip() for i in brands]
+        brand_ids = [
+            i["id"]
+            for i in api_brands
+            if not brands or i["name"].lower().strip() in brands or i["logo_text"].lower().strip() in brands
+        ]
+        if not brand_ids:
+            await self.error_and_exit(f'No brands match: [underline]{", ".join(brands)}[/underline]')
+
+        # pairs already present in the output file are not searched again
+        done = {(int(i["origin_id"]), int(i["destination_id"])) for i in read_matrix_rows(output)} if output else set()
+        pairs = [(a, b) for a, b in permutations(resolved, 2) if (a["id"], b["id"]) not in done]
+        if done:
+            self.print(f"[bold blue]resuming[/bold blue], {len(done)} pairs already in {output}")
+        semaphore = Semaphore(max(concurrency, 1))
+
+        async def fastest(origin: ExtendedStationInfo, destination: ExtendedStationInfo) -> dict[str, t.Any]:
+            async with semaphore:
+                results = await self.search_connection_pages(
+                    lambda fetch_date: self.v3_connection_search(origin, destination, brand_ids, fetch_date, direct),
+                    date,
+                    length,
+                    "uuid",
+                    1,
+                )
+            best = min(results, key=lambda i: (i["duration"], i["changes"]), default=None)
+            return {
+                "origin_id": origin["id"],
+                "origin": origin["name"],
+                "destination_id": destination["id"],
+                "destination": destination["name"],
+                "departure": best and best["departure"],
+                "arrival": best and best["arrival"],
+                "duration": best and best["duration"],
+                "changes": best and best["changes"],
+                "uuid": best and best["uuid"],
+            }
+
+        f = open(output, "a", newline="") if output else None
+        writer = csv.DictWriter(f, MATRIX_FIELDS) if f and output.endswith(".csv") else None
+        if writer and f.tell() == 0:
+            writer.writeheader()
+        try:
+            # rows are written as soon as a pair finishes so an interrupted run keeps its progress
+            for task in as_completed([fastest(a, b) for a, b in pairs]):
+                row = await task
+                if writer:
+                    writer.writerow(row)
+                elif f:
+                    f.write(dumps(row).decode() + "\n")
+                if f:
+                    f.flush()
+                if self.machine_output:
+                    self.emit(row)
+                elif row["duration"] is None:
+                    self.print(
+                        f"[purple]{row["origin"]}[/purple] → [purple]{row["destination"]}[/purple]: no connections"
+                    )
+                else:
+                    self.print(
+                        f"[purple]{row["origin"]}[/purple] → [purple]{row["destination"]}[/purple]: [bold green]{row["duration"]//60}h{row["duration"] % 60}m[/bold green] {row["changes"]} changes"
+                    )
+        finally:
+            if f:
+                f.close()
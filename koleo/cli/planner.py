@@ -0,0 +1,160 @@
+from asyncio import Semaphore, gather
+from datetime import datetime, timedelta
+
+from koleo.api.types import ApiBrand, ExtendedStationInfo, TrainDetailResponse
+from koleo.planner import PlannedJourney, Timetable
+from koleo.snapshot import Snapshot, SnapshotError
+from koleo.utils import koleo_time_to_dt
+
+from .station_board import StationBoard
+
+
+PLANNER_HORIZON = timedelta(hours=6)
+PLANNER_CONCURRENCY = 8
+PLANNER_MAX_LEGS = 4
+# the boards only list trains calling at the given stations, so a train between two changes elsewhere is never seen
+PLANNER_COVERAGE_NOTE = "only trains calling at the start, destination or --via stations are considered"
+
+
+class Planner(StationBoard):
+    async def local_connections_view(
+        self,
+        start: str,
+        end: str,
+        date: datetime,
+        brands: list[str],
+        direct: bool,
+        length: int = 1,
+        via: list[str] | None = None,
+        min_transfer: int = 5,
+        snapshot: str | None = None,
+    ):
+        start_station, end_station, api_brands, *via_stations = await gather(
+            self.get_station(start),
+            self.get_station(end),
+            self.get_brands(),
+            *(self.get_station(i) for i in via or []),
+        )
+        brands = [i.lower().strip() for i in brands]
+        connection_brands = {
+            i["name"]: i["id"]
+            for i in api_brands
+            if not brands or i["name"].lower().strip() in brands or i["logo_text"].lower().strip() in brands
+        }
+        if not connection_brands:
+            await self.error_and_exit(f'No brands match: [underline]{", ".join(brands)}[/underline]')
+        if snapshot:
+            timetable = Timetable()
+            try:
+                opened = Snapshot(snapshot)
+            except (OSError, SnapshotError) as e:
+                await self.error_and_exit(str(e))
+            timetable.add_snapshot(opened, set(connection_brands.values()))
+            opened.close()
+        else:
+            timetable = await self.build_timetable(
+                [start_station, *via_stations], end_station, date, set(connection_brands.values())
+            )
+        journeys = timetable.alternatives(
+            start_station["id"],
+            end_station["id"],
+            date,
+            length,
+            via=[i["id"] for i in via_stations],
+            min_transfer=timedelta(minutes=min_transfer),
+            max_legs=1 if direct else PLANNER_MAX_LEGS,
+        )
+        if not journeys:
+            await self.error_and_exit(
+                f"No connections found in {snapshot}"
+                if snapshot
+                else f"No connections found in the local timetable within {PLANNER_HORIZON.total_seconds() // 3600:.0f}h, {PLANNER_COVERAGE_NOTE}"
+            )
+        via_info = f" via {", ".join(i["name"] for i in via_stations)}" if via_stations else ""
+        parts = [
+            f"[bold blue]{start_station["name"]} → {end_station["name"]}{via_info} at {self.ftime(date)} {date.strftime("%d-%m")}[/bold blue] (local, ≥{min_transfer}m transfers)"
+        ]
+        for journey in journeys:
+            if self.machine_output:
+                self.emit(self.journey_record(journey, timetable, api_brands))
+                continue
+            travel_time = int((journey.arrival - journey.departure).total_seconds())
+            date_part = f"{journey.departure.strftime("%d-%m")} " if journey.departure.date() != date.date() else ""
+            date_part_2 = (
+                f"{journey.arrival.strftime("%d-%m")} " if journey.arrival.date() != journey.departure.date() else ""
+            )
+            parts.append(
+                f"[bold green]{date_part}{self.ftime(journey.departure)} - {date_part_2}{self.ftime(journey.arrival)}[/bold green] {travel_time//3600}h{(travel_time % 3600)/60:.0f}m, {journey.changes} changes:"
+            )
+            for leg in journey.legs:
+                train = timetable.trains[leg.train_id]
+                brand = next(iter(i for i in api_brands if i["id"] == train["train"]["brand_id"]), {}).get("logo_text")
+                fs, ls = train["stops"][leg.from_stop], train["stops"][leg.to_stop]
+                parts.append(
+                    f"  [red]{brand}[/red] {train["train"]["train_full_name"]} [bold green]{self.ftime(leg.departure)}[/bold green] [purple]{fs["station_display_name"]} {self.format_position(fs["platform"])}[/purple] - [bold green]{self.ftime(leg.arrival)}[/bold green] [purple]{ls["station_display_name"]} {self.format_position(ls["platform"])}[/purple]"
+                )
+        if not snapshot:
+            parts.append(f"[dim]{PLANNER_COVERAGE_NOTE}, add --via for journeys with more changes[/dim]")
+        self.print("\n".join(parts))
+
+    async def build_timetable(
+        self,
+        stations: list[ExtendedStationInfo],
+        destination: ExtendedStationInfo,
+        date: datetime,
+        brand_ids: set[int],
+    ) -> Timetable:
+        # departures from the start and via stations plus arrivals to the destination, which covers every
+        # journey with one change anywhere, further changes are only found at the via stations
+        until = date + PLANNER_HORIZON
+        boards = await gather(
+            *(self.get_board_range(i["id"], date, until=until) for i in stations),
+            self.get_board_range(destination["id"], date, type=2, until=until + PLANNER_HORIZON),
+        )
+        anchors: dict[int, tuple[int, datetime, int]] = {}
+        for station, board, type in zip([*stations, destination], boards, [*(1 for _ in stations), 2]):
+            for train in board:
+                if train["brand_id"] in brand_ids:
+                    anchors.setdefault(
+                        train["stations"][0]["train_id"],
+                        (station["id"], koleo_time_to_dt(train["departure"] if type == 1 else train["arrival"]), type),
+                    )
+        semaphore = Semaphore(PLANNER_CONCURRENCY)
+
+        async def fetch(train_id: int, anchor_time: datetime) -> TrainDetailResponse:
+            async with semaphore:
+                return await self.get_train(train_id, anchor_time)
+
+        trains = await gather(*(fetch(i, anchor_time) for i, (_, anchor_time, _) in anchors.items()))
+        timetable = Timetable()
+        for train, (station_id, anchor_time, type) in zip(trains, anchors.values()):
+            timetable.add_train(train, station_id, anchor_time, type)
+        return timetable
+
+    def journey_record(self, journey: PlannedJourney, timetable: Timetable, api_brands: list[ApiBrand]) -> dict:
+        legs = []
+        for leg in journey.legs:
+            train = timetable.trains[leg.train_id]
+            fs, ls = train["stops"][leg.from_stop], train["stops"][leg.to_stop]
+            legs.append(
+                {
+                    "train_id": leg.train_id,
+                    "train_full_name": train["train"]["train_full_name"],
+                    "brand_id": train["train"]["brand_id"],
+                    "brand": next(iter(i for i in api_brands if i["id"] == train["train"]["brand_id"]), {}).get(
+                        "logo_text"
+                    ),
+                    "origin_station_id": fs["station_id"],
+                    "origin_station": fs["station_display_name"],
+                    "departure": leg.departure.isoformat(),
+                    "destination_station_id": ls["station_id"],
+                    "destination_station": ls["station_display_name"],
+                    "arrival": leg.arrival.isoformat(),
+                }
+            )
+        return {
+            "departure": journey.departure.isoformat(),
+            "arrival": journey.arrival.isoformat(),
+            "changes": journey.changes,
+            "legs": legs,
+        }
@@ -1,15 +1,132 @@
 import typing as t
-from asyncio import gather
+from asyncio import Task, create_task, gather
 from datetime import datetime
+from itertools import pairwise
 
 from koleo.api import SeatState, SeatsAvailabilityResponse
+from koleo.api.types import (
+    CarriageType,
+    Seat,
+    SpecialCompartmentType,
+    TrainComposition,
+    TrainDetailResponse,
+    TrainStop,
+)
+from koleo.planner import stop_datetimes
+from koleo.seat_search import (
+    SeatIndex,
+    SeatKey,
+    SeatQuery,
+    TrainEnd,
+    carriage_order,
+    merge_segments,
+    minimal_seat_changes,
+    segment_masks,
+)
 from koleo.utils import BRAND_SEAT_TYPE_MAPPING, koleo_time_to_dt, find_empty_compartments, find_empty_doubles
 
+from .base import train_ttl
 from .train_info import TrainInfo
 from .utils import CLASS_COLOR_MAP
 
 
+MAX_SEAT_SEGMENTS = 8
+CARRIAGE_TYPES_TTL = 7 * 86400
+COMPOSITION_TTL = 3600
+
+
+def seat_cell(seat: Seat | None, width: int, special_types: set[int]) -> str:
+    # free seats show their number, special compartments mark it with a * and taken ones are dotted out,
+    # so the map reads without colors too
+    if seat is None:
+        return " " * width
+    if seat["state"] != "FREE":
+        return f"[red]{"·" * width}[/red]"
+    if seat["special_compartment_type_id"] in special_types:
+        return f"[yellow]{seat["seat_nr"] + "*":>{width}}[/yellow]"
+    return f"[green]{seat["seat_nr"]:>{width}}[/green]"
+
+
+def cell_width(seats: dict[str, Seat], special_types: set[int]) -> int:
+    # the * of special compartments gets its own column, only in carriages that have them
+    return max(len(i) for i in seats) + any(i["special_compartment_type_id"] in special_types for i in seats.values())
+
+
+def carriage_grid(seats: dict[str, Seat], layout: CarriageType, special_types: set[int]) -> list[str]:
+    # seat coordinates are squashed onto a grid, rows follow y and columns follow x
+    placed = [i for i in layout["seats"] if str(i["nr"]) in seats]
+    if len(placed) != len(seats):
+        return []
+    xs = {x: n for n, x in enumerate(sorted({i["x"] for i in placed}))}
+    ys = {y: n for n, y in enumerate(sorted({i["y"] for i in placed}))}
+    width = cell_width(seats, special_types)
+    grid = [[" " * width] * len(xs) for _ in ys]
+    for seat in placed:
+        grid[ys[seat["y"]]][xs[seat["x"]]] = seat_cell(seats[str(seat["nr"])], width, special_types)
+    return [" ".join(row).rstrip() for row in grid]
+
+
+def carriage_rows(seats: dict[str, Seat], special_types: set[int]) -> list[str]:
+    # without a layout every compartment (all but the last digit of the seat number) gets one line
+    width = cell_width(seats, special_types)
+    compartments: dict[str, list[Seat]] = {}
+    for seat in sorted(seats.values(), key=lambda i: int(i["seat_nr"]) if i["seat_nr"].isnumeric() else 0):
+        compartments.setdefault(seat["seat_nr"][:-1], []).append(seat)
+    return [" ".join(seat_cell(i, width, special_types) for i in row) for row in compartments.values()]
+
+
+class TrainConnection(t.TypedDict):
+    id: int
+    brand_id: int
+    train_nr: int
+
+
 class Seats(TrainInfo):
+    # carriage types are static reference data, indexed by id once per process
+    # the seat map asks for every carriage at once, so concurrent callers share the in-flight request
+    _carriage_types: Task[dict[int, CarriageType]] | None = None
+    _carriage_type_requests: dict[int, Task[CarriageType]] | None = None
+
+    async def load_carriage_types(self) -> dict[int, CarriageType]:
+        if not (carriage_types := self.storage.get_cache("carriage_types")):
+            carriage_types = self.storage.set_cache(
+                "carriage_types", await self.client.get_carriage_types(), ttl=CARRIAGE_TYPES_TTL
+            )
+        return {i["id"]: i for i in carriage_types}
+
+    async def get_carriage_types(self) -> dict[int, CarriageType]:
+        if self._carriage_types is None:
+            self._carriage_types = create_task(self.load_carriage_types())
+        return await self._carriage_types
+
+    async def get_carriage_type(self, id: int) -> CarriageType:
+        carriage_types = await self.get_carriage_types()
+        if id not in carriage_types:
+            # types added after the list was cached are fetched one by one and kept in the index
+            if self._carriage_type_requests is None:
+                self._carriage_type_requests = {}
+            if id not in self._carriage_type_requests:
+                self._carriage_type_requests[id] = create_task(self.client.get_carriage_type(id))
+            carriage_type = await self._carriage_type_requests[id]
+            if id not in carriage_types:
+                carriage_types[id] = carriage_type
+                self.storage.set_cache("carriage_types", list(carriage_types.values()), ttl=CARRIAGE_TYPES_TTL)
+        return carriage_types[id]
+
+    async def get_train_composition(self, connection_id: int, train_nr: int, place_type: int) -> TrainComposition:
+        cache_id = f"comp-{connection_id}-{train_nr}-{place_type}"
+        return self.storage.get_cache(cache_id) or self.storage.set_cache(
+            cache_id, await self.client.get_train_composition(connection_id, train_nr, place_type), ttl=COMPOSITION_TTL
+        )
+
+    async def find_train_composition(
+        self, connection_id: int, train_nr: int, place_type: int
+    ) -> TrainComposition | None:
+        try:
+            return await self.get_train_composition(connection_id, train_nr, place_type)
+        except self.client.errors.KoleoNotFound:
+            return None
+
     async def train_passenger_stats_view(
         self,
         brand: str,
@@ -19,12 +136,8 @@ class Seats(TrainInfo):
         type: str | None = None,
         detailed: bool = False,
     ):
-        train_calendars = await self.get_train_calendars(brand, name)
-        if not (train_id := train_calendars[0]["date_train_map"].get(date.strftime("%Y-%m-%d"))):
-            await self.error_and_exit(
-                f"This train doesn't run on the selected date: [underline]{date.strftime("%Y-%m-%d")}[/underline]"
-            )
-        train_details = await self.client.get_train(train_id)
+        _, train_id = await self.get_train_id(brand, name, date)
+        train_details = await self.get_train(train_id, date)
         if train_details["train"]["brand_id"] not in BRAND_SEAT_TYPE_MAPPING:
             await self.error_and_exit(f"Brand [underline]{brand}[/underline] is not supported.")
         train_stops_slugs = [i["station_slug"] for i in train_details["stops"]]
@@ -43,26 +156,18 @@ class Seats(TrainInfo):
                 )
         else:
             first_station, last_station = train_stops_slugs[0], train_stops_slugs[-1]
-        connections = await self.client.get_connections(
-            first_station,
-            last_station,
-            brand_ids=[train_details["train"]["brand_id"]],
-            direct=True,
-            date=koleo_time_to_dt(train_stops_by_slug[first_station]["departure"], base_date=date),
-        )
-        connection = next(
-            iter(i for i in connections if i["trains"][0]["train_id"] == train_details["train"]["id"]), None
+        connection = await self.get_train_connection(
+            train_details, first_station, last_station, train_stops_by_slug[first_station], date
         )
         if connection is None:
             await self.error_and_exit("Train connection not found:<\nplease try clearing the cache")
-        connection_train = connection["trains"][0]
-        if connection_train["brand_id"] not in BRAND_SEAT_TYPE_MAPPING:
-            await self.error_and_exit(f"Brand [underline]{connection_train["brand_id"]}[/underline] is not supported.")
+        if connection["brand_id"] not in BRAND_SEAT_TYPE_MAPPING:
+            await self.error_and_exit(f"Brand [underline]{connection["brand_id"]}[/underline] is not supported.")
         await self.show_train_header(
             train_details, train_stops_by_slug[first_station], train_stops_by_slug[last_station]
         )
         await self.train_seat_info(
-            connection["id"], type, connection_train["brand_id"], connection_train["train_nr"], detailed=detailed
+            connection["id"], type, connection["brand_id"], connection["train_nr"], detailed=detailed
         )
 
     async def train_connection_stats_view(self, connection_id: int, type: str | None, detailed: bool = False):
@@ -70,7 +175,7 @@ class Seats(TrainInfo):
         train = connection["trains"][0]
         if train["brand_id"] not in BRAND_SEAT_TYPE_MAPPING:
             await self.error_and_exit(f'Brand [underline]{train["brand_id"]}[/underline] is not supported.')
-        train_details = await self.client.get_train(train["train_id"])
+        train_details = await self.get_train(train["train_id"], koleo_time_to_dt(connection["departure"]))
         first_stop = next(iter(i for i in train_details["stops"] if i["station_id"] == connection["start_station_id"]))
         last_stop = next(iter(i for i in train_details["stops"] if i["station_id"] == connection["end_station_id"]))
         await self.show_train_header(train_details, first_stop, last_stop)
@@ -84,13 +189,16 @@ class Seats(TrainInfo):
         stations: tuple[str, str] | None = None,
         type: str | None = None,
         mode: t.Literal["fast", "optimized"] = "optimized",
+        window: bool = False,
+        compartment: bool = False,
+        pair: bool = False,
+        end: TrainEnd | None = None,
+        allow_special: bool = False,
+        limit: int = 5,
+        segments: bool = False,
     ):
-        train_calendars = await self.get_train_calendars(brand, name)
-        if not (train_id := train_calendars[0]["date_train_map"].get(date.strftime("%Y-%m-%d"))):
-            await self.error_and_exit(
-                f"This train doesn't run on the selected date: [underline]{date.strftime("%Y-%m-%d")}[/underline]"
-            )
-        train_details = await self.client.get_train(train_id)
+        _, train_id = await self.get_train_id(brand, name, date)
+        train_details = await self.get_train(train_id, date)
         if train_details["train"]["brand_id"] not in BRAND_SEAT_TYPE_MAPPING:
             await self.error_and_exit(f"Brand [underline]{brand}[/underline] is not supported.")
         train_stops_slugs = [i["station_slug"] for i in train_details["stops"]]
@@ -107,46 +215,181 @@ class Seats(TrainInfo):
                 await self.error_and_exit(
                     f"Train [underline]{name}[/underline] doesn't stop at [underline]{last_station}[/underline]"
                 )
-            required_stops_num = train_stops_slugs.index(last_station) - train_stops_slugs.index(first_station) + 1
         else:
             first_station, last_station = train_stops_slugs[0], train_stops_slugs[-1]
-            required_stops_num = len(train_stops_by_slug)
 
-        connections = await self.client.get_connections(
-            first_station,
-            last_station,
-            brand_ids=[train_details["train"]["brand_id"]],
-            direct=True,
-            date=koleo_time_to_dt(train_stops_by_slug[first_station]["departure"], base_date=date),
-        )
-        connection = next(
-            iter(i for i in connections if i["trains"][0]["train_id"] == train_details["train"]["id"]), None
+        connection = await self.get_train_connection(
+            train_details, first_station, last_station, train_stops_by_slug[first_station], date
         )
         if connection is None:
             await self.error_and_exit("Train connection not found:<\nplease try clearing the cache")
-        connection_train = connection["trains"][0]
-        if connection_train["brand_id"] not in BRAND_SEAT_TYPE_MAPPING:
-            await self.error_and_exit(f"Brand [underline]{connection_train["brand_id"]}[/underline] is not supported.")
+        if connection["brand_id"] not in BRAND_SEAT_TYPE_MAPPING:
+            await self.error_and_exit(f"Brand [underline]{connection["brand_id"]}[/underline] is not supported.")
+        seat_name_map = BRAND_SEAT_TYPE_MAPPING[connection["brand_id"]]
+        types = await self.get_seat_types(type, seat_name_map)
+        query = SeatQuery(window, compartment, pair, end, allow_special)
+        # with --segments only the segments' availability is used, the whole journey's isn't fetched
+        availability_requests = (
+            self.get_segment_availability(train_details, first_station, last_station, date, types)
+            if segments
+            else gather(
+                *(self.client.get_seats_availability(connection["id"], connection["train_nr"], i) for i in types)
+            )
+        )
+        # compositions are only needed to rank carriages by their position in the train
+        availability, compositions = await gather(
+            availability_requests,
+            gather(*(self.find_train_composition(connection["id"], connection["train_nr"], i) for i in types if end)),
+        )
+        if end and not any(compositions):
+            self.warn(f"This train has no composition data, seats aren't ranked by the distance to the {end}")
+        compositions = compositions or [None] * len(types)
+        free_throughout = True
+        if segments:
+            split_stops, segment_availability = availability
+            merged = merge_segments(segment_availability)
+            availability = [merged[i] for i in types]
+            free_throughout = any(seat["state"] == "FREE" for i in availability for seat in i["seats"])
+        index = SeatIndex()
+        for seat_type, seats, composition in zip(types, availability, compositions):
+            index.add(seat_type, seats, composition, end)
+        if mode == "fast":
+            results = [i] if (i := index.find_first(query)) else []
+        else:
+            results = index.find_best(query, limit)
+        if not results and not free_throughout:
+            plan = minimal_seat_changes(segment_masks(segment_availability), len(segment_availability))
+            if not plan:
+                await self.error_and_exit("No combination of free seats covers the whole journey")
+            await self.show_train_header(
+                train_details, train_stops_by_slug[first_station], train_stops_by_slug[last_station]
+            )
+            self.show_seat_changes(plan, split_stops, seat_name_map)
+            return
+        if not results:
+            await self.error_and_exit("No free seat matches the given constraints")
         await self.show_train_header(
             train_details, train_stops_by_slug[first_station], train_stops_by_slug[last_station]
         )
-        await self.train_seat_info(
-            connection["id"], type, connection_train["brand_id"], connection_train["train_nr"], detailed=detailed
+        for seat in results:
+            if self.machine_output:
+                self.emit({**seat._asdict(), "type": seat_name_map[seat.place_type], "connection_id": connection["id"]})
+                continue
+            color = CLASS_COLOR_MAP.get(seat_name_map[seat.place_type], "")
+            tags = [
+                *(["window"] if seat.window else []),
+                *(["empty compartment"] if seat.empty_compartment else []),
+                *([f"free pair with {seat.partner}"] if seat.partner else []),
+                *([f"{seat.end_proximity:.0%} towards the {end}"] if seat.end_proximity is not None else []),
+                *(["special compartment"] if seat.special else []),
+            ]
+            self.print(
+                f"[bold {color}]{seat_name_map[seat.place_type]}[/bold {color}] carriage [bold]{seat.carriage_nr}[/bold] seat [bold]{seat.seat_nr}[/bold] {", ".join(tags)}"
+            )
+
+    async def get_segment_availability(
+        self,
+        train_details: TrainDetailResponse,
+        first_station: str,
+        last_station: str,
+        date: datetime,
+        types: list[int],
+    ) -> tuple[list[TrainStop], list[dict[int, SeatsAvailabilityResponse]]]:
+        # the journey is split at (up to MAX_SEAT_SEGMENTS evenly spread) intermediate stops,
+        # every segment is its own connection with its own seat reservations
+        stops = train_details["stops"]
+        slugs = [i["station_slug"] for i in stops]
+        start, end = slugs.index(first_station), slugs.index(last_station)
+        count = min(end - start, MAX_SEAT_SEGMENTS)
+        points = sorted({start + round(n * (end - start) / count) for n in range(count + 1)})
+        connections = await gather(
+            *(self.get_train_connection(train_details, slugs[a], slugs[b], stops[a], date) for a, b in pairwise(points))
+        )
+        if missing := [slugs[a] for (a, _), i in zip(pairwise(points), connections) if i is None]:
+            await self.error_and_exit(f"Train connection not found for the segment from {", ".join(missing)}")
+        availability = await gather(
+            *(
+                gather(*(self.client.get_seats_availability(i["id"], i["train_nr"], seat_type) for seat_type in types))
+                for i in connections
+            )
+        )
+        return [stops[i] for i in points], [dict(zip(types, i)) for i in availability]
+
+    def show_seat_changes(
+        self,
+        plan: list[tuple[SeatKey, int, int]],
+        split_stops: list[TrainStop],
+        seat_name_map: dict[int, str],
+    ):
+        if not self.machine_output:
+            self.print(f"no seat is free for the whole journey, {len(plan) - 1} seat changes needed:")
+        for (place_type, carriage_nr, seat_nr), start, end in plan:
+            first_stop, last_stop = split_stops[start], split_stops[end]
+            if self.machine_output:
+                self.emit(
+                    {
+                        "place_type": place_type,
+                        "type": seat_name_map[place_type],
+                        "carriage_nr": carriage_nr,
+                        "seat_nr": seat_nr,
+                        "from_station_id": first_stop["station_id"],
+                        "to_station_id": last_stop["station_id"],
+                    }
+                )
+                continue
+            color = CLASS_COLOR_MAP.get(seat_name_map[place_type], "")
+            self.print(
+                f"  [purple]{first_stop["station_display_name"]}[/purple] → [purple]{last_stop["station_display_name"]}[/purple]: [bold {color}]{seat_name_map[place_type]}[/bold {color}] carriage [bold]{carriage_nr}[/bold] seat [bold]{seat_nr}[/bold]"
+            )
+
+    async def get_train_connection(
+        self,
+        train_details: TrainDetailResponse,
+        first_station: str,
+        last_station: str,
+        first_stop: TrainStop,
+        date: datetime,
+    ) -> TrainConnection | None:
+        # the connection id of a train between two of its stops only changes with the train id,
+        # so the direct connections search runs once per (train, from, to)
+        train_id = train_details["train"]["id"]
+        cache_id = f"tconn-{train_id}-{first_station}-{last_station}"
+        if connection := self.storage.get_cache(cache_id):
+            return connection
+        # stops only carry the time of day, stops after midnight are searched on the next day
+        stops = train_details["stops"]
+        first_departure = koleo_time_to_dt(stops[0]["departure"], base_date=date)
+        departure = stop_datetimes(train_details, stops[0]["station_id"], first_departure)[stops.index(first_stop)][1]
+        connections = await self.client.get_connections(
+            first_station,
+            last_station,
+            brand_ids=[train_details["train"]["brand_id"]],
+            direct=True,
+            date=departure,
         )
+        found = next(iter(i for i in connections if i["trains"][0]["train_id"] == train_id), None)
+        if found is None:
+            return None
+        return self.storage.set_cache(
+            cache_id,
+            {"id": found["id"], "brand_id": found["trains"][0]["brand_id"], "train_nr": found["trains"][0]["train_nr"]},
+            ttl=train_ttl(date),
+        )
+
+    async def get_seat_types(self, type: str | None, seat_name_map: dict[int, str]) -> list[int]:
+        if type is None:
+            return list(seat_name_map.keys())
+        if type.isnumeric() and int(type) in seat_name_map:
+            return [int(type)]
+        elif type_id := {v: k for k, v in seat_name_map.items()}.get(type):
+            return [type_id]
+        await self.error_and_exit(f"Invalid seat type [underline]{type}[/underline].")
 
     async def train_seat_info(
         self, connection_id: int, type: str | None, brand_id: int, train_nr: int, *, detailed: bool = False
     ):
         seat_name_map = BRAND_SEAT_TYPE_MAPPING[brand_id]
-        if type is not None:
-            if type.isnumeric() and int(type) in seat_name_map:
-                types = [int(type)]
-            elif type_id := {v: k for k, v in seat_name_map.items()}.get(type):
-                types = [type_id]
-            else:
-                await self.error_and_exit(f"Invalid seat type [underline]{type}[/underline].")
-        else:
-            types = seat_name_map.keys()
+        types = await self.get_seat_types(type, seat_name_map)
         res: dict[int, SeatsAvailabilityResponse] = {}
         for seat_type in types:
             res[seat_type] = await self.client.get_seats_availability(connection_id, train_nr, seat_type)
@@ -170,6 +413,22 @@ class Seats(TrainInfo):
             total = sum(i for i in counters.values())
             if not total:
                 continue
+            if self.machine_output:
+                record = {
+                    "connection_id": connection_id,
+                    "train_nr": train_nr,
+                    "type_id": seat_type,
+                    "type": seat_name_map[seat_type],
+                    "free": counters["FREE"],
+                    "reserved": counters["RESERVED"],
+                    "blocked": counters["BLOCKED"],
+                    "special": counters["SPECIAL"],
+                    "total": total,
+                }
+                if detailed:
+                    record["seats"] = result["seats"]
+                self.emit(record)
+                continue
             self.print(f"[bold {color}]{seat_name_map[seat_type]}: [/bold {color}]")
             self.print(f"  Free: [{color}]{counters["FREE"]}/{total}, ~{counters["FREE"]/total*100:.1f}%[/{color}]")
             # self.print(f"  Special: [{color}]{counters["SPECIAL"]}/{total}, ~{counters["SPECIAL"]/total*100:.1f}%[/{color}]")
@@ -178,18 +437,47 @@ class Seats(TrainInfo):
             taken = counters["BLOCKED"] + counters["RESERVED"]
             self.print(f"  Total: [underline {color}]{taken}/{total}, ~{taken/total*100:.1f}%[/underline {color}]")
 
-        if detailed:  # super temporary!!!!!!
-            for seat_type, result in res.items():
-                type_color = CLASS_COLOR_MAP.get(seat_name_map[seat_type], "")
-                self.print(f"[bold {type_color}]{seat_name_map[seat_type]}: [/bold {type_color}]")
-                for seat in result["seats"]:
-                    color = "green" if seat["state"] == "FREE" else "red"
-                    if special := special_compartment_types.get(seat["special_compartment_type_id"]):
-                        special = f", {special["icon"].upper().replace("_", " ")}"
-                        if color == "green":
-                            color = "yellow"
-                    else:
-                        special = ""
-                    self.print(
-                        f" [{type_color}]{seat["carriage_nr"]}[/{type_color}] {seat['seat_nr']}: [{color}]{seat["state"]}{special}[/{color}]"
-                    )
+        if detailed and not self.machine_output:
+            await self.show_seat_maps(connection_id, train_nr, res, seat_name_map, special_compartment_types)
+
+    async def show_seat_maps(
+        self,
+        connection_id: int,
+        train_nr: int,
+        res: dict[int, SeatsAvailabilityResponse],
+        seat_name_map: dict[int, str],
+        special_compartment_types: dict[int, SpecialCompartmentType],
+    ):
+        # one pre-built block per carriage instead of a print per seat
+        try:
+            compositions = dict(
+                zip(res, await gather(*(self.get_train_composition(connection_id, train_nr, i) for i in res)))
+            )
+        except self.client.errors.KoleoNotFound:
+            compositions = {}
+        special_types = set(special_compartment_types)
+        for seat_type, result in res.items():
+            type_color = CLASS_COLOR_MAP.get(seat_name_map[seat_type], "")
+            by_carriage: dict[str, dict[str, Seat]] = {}
+            for seat in result["seats"]:
+                by_carriage.setdefault(seat["carriage_nr"], {})[seat["seat_nr"]] = seat
+            carriage_type_ids = {
+                i["number"]: i["carriage_type_id"] for i in compositions.get(seat_type, {}).get("carriages", [])
+            }
+            layouts = dict(
+                zip(
+                    carriage_type_ids,
+                    await gather(*(self.get_carriage_type(i) for i in carriage_type_ids.values())),
+                )
+            )
+            blocks = [f"[bold {type_color}]{seat_name_map[seat_type]}: [/bold {type_color}]"]
+            for carriage_nr, seats in sorted(by_carriage.items(), key=lambda i: carriage_order(i[0])):
+                layout = layouts.get(carriage_nr)
+                lines = (layout and carriage_grid(seats, layout, special_types)) or carriage_rows(seats, special_types)
+                free = sum(i["state"] == "FREE" for i in seats.values())
+                blocks.append(
+                    f" [{type_color}]carriage {carriage_nr}[/{type_color}] {free}/{len(seats)} free\n"
+                    + "\n".join(f"  {i}" for i in lines)
+                )
+            self.print("\n".join(blocks))
+        self.print("[green]12[/green] free, [yellow]12*[/yellow] free in a special compartment, [red]··[/red] taken")
@@ -0,0 +1,106 @@
+from asyncio import Semaphore, gather
+from datetime import datetime, timedelta
+from os.path import getsize
+
+from koleo.api.types import ExtendedStationInfo, TrainDetailResponse, TrainOnStationInfo
+from koleo.planner import stop_datetimes
+from koleo.snapshot import Snapshot, SnapshotError, write_snapshot
+from koleo.utils import koleo_time_to_dt
+
+from .base import BaseCli
+
+
+SNAPSHOT_CONCURRENCY = 8
+
+
+class Snapshots(BaseCli):
+    async def snapshot_build_view(self, stations: list[str], date: datetime, days: int, output: str):
+        semaphore = Semaphore(SNAPSHOT_CONCURRENCY)
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
+        async def fetch_board(st: ExtendedStationInfo, day: datetime, type: int) -> list[TrainOnStationInfo]:
+            # one missing board shouldn't throw away the rest of the crawl
+            try:
+                if type == 1:
+                    return await bounded(self.client.get_departures(st["id"], day))
+                return await bounded(self.client.get_arrivals(st["id"], day))
+            except self.client.errors.KoleoNotFound:
+                kind = "departures" if type == 1 else "arrivals"
+                self.warn(f"No {kind} for {st["name"]} on {day.strftime("%d-%m")}, skipping")
+                return []
+
+        async def fetch_train(train_id: int) -> TrainDetailResponse | None:
+            try:
+                return await bounded(self.client.get_train(train_id))
+            except self.client.errors.KoleoNotFound:
+                self.warn(f"Train {train_id} not found, skipping")
+                return None
+
+        resolved = await gather(*(self.get_station(i) for i in stations))
+        dates = [date.replace(hour=0, minute=0) + timedelta(days=n) for n in range(days)]
+        queries = [(st, day, type) for st in resolved for day in dates for type in (1, 2)]
+        boards: list[list[TrainOnStationInfo]] = await gather(*(fetch_board(*i) for i in queries))
+        # every train is fetched once, anchored on the first board it was seen on
+        anchors: dict[int, tuple[int, datetime, int]] = {}
+        for (st, _, type), board in zip(queries, boards):
+            for train in board:
+                anchors.setdefault(
+                    train["stations"][0]["train_id"],
+                    (st["id"], koleo_time_to_dt(train["departure"] if type == 1 else train["arrival"]), type),
+                )
+        self.print(
+            f"[bold blue]{len(boards)}[/bold blue] boards crawled, fetching [bold blue]{len(anchors)}[/bold blue] trains"
+        )
+        fetched = await gather(*(fetch_train(i) for i in anchors))
+        found = [(train, anchor) for train, anchor in zip(fetched, anchors.values()) if train]
+        trains = [train for train, _ in found]
+        station_names = {st["id"]: st["name"] for st in resolved}
+        for train in trains:
+            for stop in train["stops"]:
+                station_names.setdefault(stop["station_id"], stop["station_display_name"])
+        write_snapshot(
+            output,
+            station_names,
+            [
+                (train, stop_datetimes(train, station_id, anchor_time, type))
+                for train, (station_id, anchor_time, type) in found
+            ],
+        )
+        if self.machine_output:
+            self.emit({"path": output, "stations": len(station_names), "trips": len(trains), "size": getsize(output)})
+            return
+        self.print(
+            f"[bold green]saved {len(trains)} trips through {len(station_names)} stations to {output}[/bold green] ({getsize(output) / 1024:.1f}KiB)"
+        )
+
+    async def snapshot_info_view(self, path: str):
+        try:
+            snapshot = Snapshot(path)
+        except (OSError, SnapshotError) as e:
+            await self.error_and_exit(str(e))
+        trips = list(snapshot.trips())
+        first = min((snapshot.stop_times(i)[0].departure for i in trips), default=None)
+        last = max((snapshot.stop_times(i)[-1].arrival for i in trips), default=None)
+        if self.machine_output:
+            self.emit(
+                {
+                    "path": path,
+                    "stations": snapshot.station_count,
+                    "trips": snapshot.trip_count,
+                    "stop_times": snapshot.stop_time_count,
+                    "first_departure": first and first.isoformat(),
+                    "last_arrival": last and last.isoformat(),
+                }
+            )
+        else:
+            self.print(
+                f"[bold blue]{path}[/bold blue]: {snapshot.station_count} stations, {snapshot.trip_count} trips, {snapshot.stop_time_count} stop times"
+            )
+            if first and last:
+                self.print(
+                    f"covers [bold green]{first.strftime("%d-%m %H:%M")} - {last.strftime("%d-%m %H:%M")}[/bold green]"
+                )
+        snapshot.close()
@@ -1,8 +1,55 @@
-from asyncio import gather
+import sys
+import typing as t
+from asyncio import CancelledError, gather, sleep
+from bisect import bisect_right
 from datetime import datetime, timedelta
+from heapq import merge
+from itertools import takewhile
+from operator import itemgetter
+from time import monotonic
 
 from .base import BaseCli
-from koleo.utils import koleo_time_to_dt
+from koleo.api.types import ApiBrand, EstimatedTrainTime, ExtendedStationInfo, TrainOnStationInfo
+from koleo.utils import estimated_delay
+
+
+if t.TYPE_CHECKING:
+    from rich.live import Live
+    from rich.text import Text
+
+
+TimelineEntry = tuple[float, int, TrainOnStationInfo, datetime]
+
+WATCH_BOARD_TTL = 300
+ESTIMATES_TTL = 60
+ESTIMATES_CHUNK_SIZE = 50
+WATCH_LOOKBEHIND = timedelta(minutes=30)
+
+
+def board_timeline(trains: list[TrainOnStationInfo], type: int = 1) -> list[TimelineEntry]:
+    # parses every timestamp exactly once, the api already returns boards ordered by time
+    key = "departure" if type == 1 else "arrival"
+    timeline: list[TimelineEntry] = []
+    for train in trains:
+        dt = datetime.fromisoformat(train[key])  # type: ignore
+        timeline.append((dt.timestamp(), type, train, dt))
+    return timeline
+
+
+def timeline_after(timeline: list[TimelineEntry], date: datetime) -> list[TimelineEntry]:
+    return timeline[bisect_right(timeline, date.timestamp(), key=itemgetter(0)) :]
+
+
+def tag_timeline(timeline: list[TimelineEntry], station: ExtendedStationInfo):
+    for ts, _, train, dt in timeline:
+        yield ts, train, dt, station
+
+
+def board_days(date: datetime, days: int | None = None, until: datetime | None = None) -> list[datetime]:
+    if until is not None:
+        span = (until.date() - date.date()).days + 1
+        days = min(days, span) if days else span
+    return [date + timedelta(days=n) for n in range(max(days or 1, 0))]
 
 
 class StationBoard(BaseCli):
@@ -18,58 +65,306 @@ class StationBoard(BaseCli):
             cache_id, await self.client.get_departures(station_id, date)
         )
 
-    async def full_departures_view(self, station: str, date: datetime):
+    async def get_board_range(
+        self,
+        station_id: int,
+        date: datetime,
+        type: int = 1,
+        days: int | None = None,
+        until: datetime | None = None,
+    ) -> list[TrainOnStationInfo]:
+        # days past the --until cutoff are never requested
+        fetch = self.get_departures if type == 1 else self.get_arrivals
+        boards = await gather(*(fetch(station_id, day) for day in board_days(date, days, until)))
+        end = until.timestamp() if until else float("inf")
+        timelines = (timeline_after(board_timeline(i, type), date) for i in boards)
+        return [train for _, _, train, _ in takewhile(lambda i: i[0] <= end, merge(*timelines, key=itemgetter(0)))]
+
+    def board_header(
+        self,
+        st: ExtendedStationInfo,
+        date: datetime,
+        kind: t.Literal["odjazdy", "przyjazdy"],
+        days: int | None,
+        until: datetime | None,
+    ) -> str:
+        if until:
+            range_info = f" → {until.strftime("%d-%m")} {self.ftime(until)}"
+        elif days and days > 1:
+            range_info = f" +{days - 1}d"
+        else:
+            range_info = ""
+        return f"[bold blue][link=https://koleo.pl/dworzec-pkp/{st["name_slug"]}/{kind}/{date.strftime("%Y-%m-%d")}]{st["name"]} at {date.strftime("%d-%m")} {self.ftime(date)}{range_info}[/bold blue] ID: {st["id"]}[/link]"
+
+    async def get_estimated_train_times(
+        self, station_id: int, date: datetime, train_ids: list[int], type: int = 1, ttl: int | None = ESTIMATES_TTL
+    ) -> dict[int, EstimatedTrainTime]:
+        if not train_ids or not self.realtime_available:
+            return {}
+        kind: t.Literal["departures", "arrivals"] = "departures" if type == 1 else "arrivals"
+        cache_id = f"est-{kind}-{station_id}-{date.strftime("%Y-%m-%d")}"
+        cached = self.storage.get_cache(cache_id) if ttl else None
+        if not cached or not set(train_ids) <= set(cached["ids"]):
+            ids = list(dict.fromkeys(train_ids))
+            try:
+                chunks = await gather(
+                    *(
+                        self.client.get_estimated_train_times(station_id, date, ids[n : n + ESTIMATES_CHUNK_SIZE], kind)
+                        for n in range(0, len(ids), ESTIMATES_CHUNK_SIZE)
+                    )
+                )
+            except (self.client.errors.KoleoUnauthorized, self.client.errors.AuthRequired):
+                self.realtime_unavailable()
+                return {}
+            cached = {"ids": ids, "estimates": {str(i["train_id"]): i for chunk in chunks for i in chunk}}
+            if ttl:
+                self.storage.set_cache(cache_id, cached, ttl=ttl)
+        return {i: estimate for i in train_ids if (estimate := cached["estimates"].get(str(i)))}
+
+    async def get_board_estimates(
+        self, station_id: int, trains: list[TrainOnStationInfo], type: int = 1
+    ) -> dict[int, EstimatedTrainTime]:
+        # one batched request per station and day instead of one per train
+        key = "departure" if type == 1 else "arrival"
+        days: dict[str, list[int]] = {}
+        for train in trains:
+            days.setdefault(train[key][:10], []).append(train["stations"][0]["train_id"])  # type: ignore
+        results = await gather(
+            *(
+                self.get_estimated_train_times(station_id, datetime.strptime(day, "%Y-%m-%d"), ids, type)
+                for day, ids in days.items()
+            )
+        )
+        return {k: v for i in results for k, v in i.items()}
+
+    async def full_departures_view(
+        self,
+        station: str,
+        date: datetime,
+        days: int | None = None,
+        until: datetime | None = None,
+        watch: bool = False,
+        interval: float = 30,
+        limit: int = 15,
+        realtime: bool = False,
+    ):
         st = await self.get_station(station)
-        station_info = f"[bold blue][link=https://koleo.pl/dworzec-pkp/{st["name_slug"]}/odjazdy/{date.strftime("%Y-%m-%d")}]{st["name"]} at {date.strftime("%d-%m")} {self.ftime(date)}[/bold blue] ID: {st["id"]}[/link]"
-        self.print(station_info)
-        trains = [
-            i
-            for i in await self.get_departures(st["id"], date)
-            if datetime.fromisoformat(i["departure"]).timestamp() > date.timestamp()  # type: ignore
-        ]
-        await self.trains_on_station_table(trains)
+        if watch:
+            return await self.watch_departures_view(st, interval, limit)
+        self.print(self.board_header(st, date, "odjazdy", days, until))
+        trains = await self.get_board_range(st["id"], date, 1, days, until)
+        estimates = await self.get_board_estimates(st["id"], trains) if realtime else None
+        await self.trains_on_station_table(
+            trains, show_date=len(board_days(date, days, until)) > 1, estimates=estimates
+        )
 
-    async def full_arrivals_view(self, station: str, date: datetime):
+    async def full_arrivals_view(
+        self,
+        station: str,
+        date: datetime,
+        days: int | None = None,
+        until: datetime | None = None,
+        realtime: bool = False,
+    ):
         st = await self.get_station(station)
-        station_info = f"[bold blue][link=https://koleo.pl/dworzec-pkp/{st["name_slug"]}/przyjazdy/{date.strftime("%Y-%m-%d")}]{st["name"]} at {date.strftime("%d-%m")} {self.ftime(date)}[/bold blue] ID: {st["id"]}[/link]"
-        self.print(station_info)
-        trains = [
-            i
-            for i in await self.get_arrivals(st["id"], date)
-            if datetime.fromisoformat(i["arrival"]).timestamp() > date.timestamp()  # type: ignore
-        ]
-        await self.trains_on_station_table(trains, type=2)
+        self.print(self.board_header(st, date, "przyjazdy", days, until))
+        trains = await self.get_board_range(st["id"], date, 2, days, until)
+        estimates = await self.get_board_estimates(st["id"], trains, 2) if realtime else None
+        await self.trains_on_station_table(
+            trains, type=2, show_date=len(board_days(date, days, until)) > 1, estimates=estimates
+        )
 
-    async def all_trains_view(self, station: str, date: datetime):
+    async def all_trains_view(self, station: str, date: datetime, realtime: bool = False):
         st = await self.get_station(station)
         station_info = f"[bold blue][link=https://koleo.pl/dworzec-pkp/{st["name_slug"]}/odjazdy/{date.strftime("%Y-%m-%d")}]{st["name"]} at {date.strftime("%d-%m")} {self.ftime(date)}[/bold blue] ID: {st["id"]}[/link]"
         self.print(station_info)
         departures, arrivals, brands = await gather(
             self.get_departures(st["id"], date), self.get_arrivals(st["id"], date), self.get_brands()
         )
+        arrivals_timeline = timeline_after(board_timeline(arrivals, 2), date)
+        departures_timeline = timeline_after(board_timeline(departures, 1), date)
+        if realtime:
+            departure_estimates, arrival_estimates = await gather(
+                self.get_board_estimates(st["id"], [i[2] for i in departures_timeline]),
+                self.get_board_estimates(st["id"], [i[2] for i in arrivals_timeline], 2),
+            )
+        else:
+            departure_estimates, arrival_estimates = {}, {}
 
-        trains = sorted(
-            [(i, 1) for i in departures] + [(i, 2) for i in arrivals],
-            key=lambda train: (
-                datetime.fromisoformat(train[0]["departure"]) + timedelta(microseconds=1)  # type: ignore
-                if train[1] == 1
-                else (datetime.fromisoformat(train[0]["arrival"]))  # type: ignore
-            ).timestamp(),
-        )
-        trains = [
-            (i, type)
-            for i, type in trains
-            if datetime.fromisoformat(i["departure"] if type == 1 else i["arrival"]).timestamp() > date.timestamp()  # type: ignore
-        ]
-        for train, type in trains:
+        # merge is stable, so arrivals are listed before departures happening at the same time
+        trains = merge(arrivals_timeline, departures_timeline, key=itemgetter(0))
+        for _, type, train, dt in trains:
+            brand = next(iter(i for i in brands if i["id"] == train["brand_id"]), {}).get("logo_text")
+            estimate = (departure_estimates if type == 1 else arrival_estimates).get(train["stations"][0]["train_id"])
+            if self.machine_output:
+                self.emit(self.train_on_station_record(train, type, brand, estimate))
+                continue
             time = (
-                f"[bold green]{self.ftime(koleo_time_to_dt(train['departure']))}[/bold green]"  # type: ignore
+                f"[bold green]{self.ftime(dt)}[/bold green]"
                 if type == 1
-                else f"[bold yellow]{self.ftime(koleo_time_to_dt(train['arrival']))}[/bold yellow]"  # type: ignore
+                else f"[bold yellow]{self.ftime(dt)}[/bold yellow]"
             )
+            if delay := estimated_delay(estimate, type):
+                time += f" [bold red]+{delay}[/bold red]"
             if self.no_color:
                 time = ("o" if type == 1 else "p") + time
-            brand = next(iter(i for i in brands if i["id"] == train["brand_id"]), {}).get("logo_text")
             self.print(
                 f"{time} [red]{brand}[/red] {train["train_full_name"]}[purple] {train["stations"][0]["name"]} {self.format_position(train["platform"], train["track"])}[/purple]"
             )
+
+    async def resolve_station_group(self, station: str) -> list[ExtendedStationInfo]:
+        st = await self.get_station(station)
+        # groups don't list their members, the stations list only shares the city with them
+        if not (st.get("is_group") or st.get("type") == "TopographicalPlace") or not st.get("city"):
+            return [st]
+        members = [
+            i
+            for i in (await self.get_stations()).values()
+            if i.get("city") == st["city"]
+            and i["id"] != st["id"]
+            and not i.get("is_group")
+            and i.get("type") not in ("TopographicalPlace", "Quay", "busStopPlace")
+            and i.get("transport_mode") != "bus"
+        ]
+        return members or [st]
+
+    async def multi_departures_view(self, stations: list[str], date: datetime):
+        groups = await gather(*(self.resolve_station_group(i) for i in stations))
+        resolved = list({st["id"]: st for group in groups for st in group}.values())
+        self.print(
+            f"[bold blue]{", ".join(i["name"] for i in resolved)} at {date.strftime("%d-%m")} {self.ftime(date)}[/bold blue]"
+        )
+        *boards, brands = await gather(*(self.get_departures(st["id"], date) for st in resolved), self.get_brands())
+        trains = merge(
+            *(tag_timeline(timeline_after(board_timeline(board), date), st) for st, board in zip(resolved, boards)),
+            key=itemgetter(0),
+        )
+        seen: set[int] = set()
+        for _, train, dt, st in trains:
+            # a train calling at several of the stations is only shown at the first one
+            if (train_id := train["stations"][0]["train_id"]) in seen:
+                continue
+            seen.add(train_id)
+            brand = next(iter(i for i in brands if i["id"] == train["brand_id"]), {}).get("logo_text")
+            if self.machine_output:
+                self.emit({**self.train_on_station_record(train, 1, brand), "from_id": st["id"], "from": st["name"]})
+                continue
+            self.print(
+                f"[bold green]{self.ftime(dt)}[/bold green] [red]{brand}[/red] {train["train_full_name"]}[purple] {train["stations"][0]["name"]}[/purple] from [blue]{st["name"]}[/blue] [purple]{self.format_position(train["platform"], train["track"])}[/purple]"
+            )
+
+    def board_row(self, train: TrainOnStationInfo, dt: datetime, brand: str | None, delay: int | None) -> str:
+        delay_part = f" [bold red]+{delay}[/bold red]" if delay else ""
+        return f"[bold green]{self.ftime(dt)}[/bold green]{delay_part} [red]{brand}[/red] {train["train_full_name"]}[purple] {train["stations"][0]["name"]} {self.format_position(train["platform"], train["track"])}[/purple]"
+
+    async def watch_departures_view(self, st: ExtendedStationInfo, interval: float, limit: int):
+        self.print(f"[bold blue]{st["name"]}[/bold blue] ID: {st["id"]}, refreshing every {interval:.0f}s")
+        brands = await self.get_brands()
+        board: list[TimelineEntry] = []
+        board_date, board_fetched = None, 0.0
+        previous: dict[int, tuple[str, TimelineEntry, EstimatedTrainTime | None]] = {}
+        live = self.start_live_board()
+        rendered: dict[int, tuple[str, "Text"]] = {}
+        try:
+            while True:
+                now = datetime.now()
+                # the board itself rarely changes, estimates are what has to be polled
+                if board_date != now.date() or monotonic() - board_fetched > WATCH_BOARD_TTL:
+                    board = board_timeline(await self.client.get_departures(st["id"], now))
+                    board_date, board_fetched = now.date(), monotonic()
+                # trains from the lookbehind window may still be waiting, so they're checked along the next ones
+                recent = timeline_after(board, now - WATCH_LOOKBEHIND)
+                candidates = recent[: bisect_right(recent, now.timestamp(), key=itemgetter(0)) + limit]
+                estimates = await self.get_estimated_train_times(
+                    st["id"], now, [i[2]["stations"][0]["train_id"] for i in candidates], ttl=None
+                )
+                rows: dict[int, tuple[str, TimelineEntry, EstimatedTrainTime | None]] = {}
+                for entry in candidates:
+                    if len(rows) >= limit:
+                        break
+                    _, _, train, dt = entry
+                    train_id = train["stations"][0]["train_id"]
+                    if self.estimated_departure(entry, estimate := estimates.get(train_id)) <= now:
+                        continue
+                    brand = next(iter(i for i in brands if i["id"] == train["brand_id"]), {}).get("logo_text")
+                    rows[train_id] = (self.board_row(train, dt, brand, estimated_delay(estimate)), entry, estimate)
+                if live:
+                    self.show_live_board(live, rendered, rows, now)
+                else:
+                    self.show_board_changes(previous, rows, brands, now)
+                previous = rows
+                await sleep(interval)
+        except CancelledError:
+            return
+        finally:
+            if live:
+                live.stop()
+
+    def start_live_board(self) -> "Live | None":
+        # terminals get the board redrawn in place, piped text keeps the change log
+        if self.machine_output:
+            return None
+        from rich.console import Console
+        from rich.live import Live
+
+        console = Console(color_system=None, highlight=False) if self.no_color else self.console
+        if not console.is_terminal:
+            return None
+        live = Live(console=console, auto_refresh=False)
+        live.start()
+        return live
+
+    def show_live_board(
+        self,
+        live: "Live",
+        rendered: dict[int, tuple[str, "Text"]],
+        rows: dict[int, tuple[str, TimelineEntry, EstimatedTrainTime | None]],
+        now: datetime,
+    ):
+        from rich.console import Group
+        from rich.text import Text
+
+        # only rows whose markup changed are parsed again, an unchanged board isn't redrawn at all
+        changed = rendered.keys() != rows.keys()
+        for train_id in rendered.keys() - rows.keys():
+            del rendered[train_id]
+        for train_id, (row, *_) in rows.items():
+            if rendered.get(train_id, ("",))[0] != row:
+                rendered[train_id] = (row, Text.from_markup(row))
+                changed = True
+        if changed:
+            header = Text.from_markup(f"[bold]updated {now.strftime("%H:%M:%S")}[/bold]")
+            live.update(Group(header, *(rendered[i][1] for i in rows)), refresh=True)
+
+    def estimated_departure(self, entry: TimelineEntry, estimate: EstimatedTrainTime | None) -> datetime:
+        if estimate and (actual := estimate["actual_departure"]):
+            return datetime.fromisoformat(actual).replace(tzinfo=None)
+        return entry[3].replace(tzinfo=None)
+
+    def show_board_changes(
+        self,
+        previous: dict[int, tuple[str, TimelineEntry, EstimatedTrainTime | None]],
+        rows: dict[int, tuple[str, TimelineEntry, EstimatedTrainTime | None]],
+        brands: list[ApiBrand],
+        now: datetime,
+    ):
+        changed = [(k, v) for k, v in rows.items() if previous.get(k, ("",))[0] != v[0]]
+        gone = [(k, v) for k, v in previous.items() if k not in rows]
+        if not changed and not gone:
+            return
+        if self.machine_output:
+            for train_id, (_, (_, _, train, _), estimate) in changed:
+                brand = next(iter(i for i in brands if i["id"] == train["brand_id"]), {}).get("logo_text")
+                change = "update" if train_id in previous else "new"
+                self.emit({**self.train_on_station_record(train, 1, brand, estimate), "change": change})
+            for train_id, (_, (_, _, train, _), estimate) in gone:
+                brand = next(iter(i for i in brands if i["id"] == train["brand_id"]), {}).get("logo_text")
+                self.emit({**self.train_on_station_record(train, 1, brand, estimate), "change": "departed"})
+            sys.stdout.flush()
+            return
+        lines = [f"[bold]{now.strftime("%H:%M:%S")}[/bold]"] if previous else []
+        for train_id, (row, *_) in changed:
+            lines.append(f"{"~ " if train_id in previous else "+ " if previous else ""}{row}")
+        for _, (row, *_) in gone:
+            lines.append(f"[strike]- {row}[/strike]")
+        self.print("\n".join(lines))
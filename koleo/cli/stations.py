@@ -28,6 +28,17 @@ class Stations(BaseCli):
                     result_info += "🏛️" if self.storage.use_station_type_emoji else "GROUP"
                 else:
                     result_info += "🚉" if self.storage.use_station_type_emoji else "RAIL"
+            if self.machine_output:
+                self.emit(
+                    {
+                        "id": st["id"],
+                        "name": st["name"],
+                        "name_slug": st["name_slug"],
+                        "type": st.get("type"),
+                        "country": st.get("country"),
+                    }
+                )
+                continue
             if result_info:
                 result_info += " "
             self.print(
@@ -1,39 +1,161 @@
-from asyncio import gather
+from asyncio import CancelledError, gather, sleep
+from bisect import bisect_left
 from datetime import datetime, timedelta
 
-from koleo.api.types import TrainCalendar, TrainDetailResponse, TrainStop
+from koleo.api.types import RealtimeTrainStop, TrainCalendar, TrainDetailResponse, TrainStop
 from koleo.utils import koleo_time_to_dt
 
 from .base import BaseCli
 
 
+LIVE_MIN_INTERVAL = 15
+LIVE_MAX_INTERVAL = 300
+CALENDAR_INDEX_TTL = 7 * 86400
+
+# sorted running dates (Y-m-d, which sorts chronologically) and the train ids running on them
+CalendarIndex = tuple[list[str], list[int]]
+
+
+def calendar_index_id(brand: str, name: str) -> str:
+    return f"tci-{brand.upper()}-{name}"
+
+
+def calendar_index(calendar: TrainCalendar) -> CalendarIndex:
+    dates = sorted(calendar["date_train_map"])
+    return dates, [calendar["date_train_map"][i] for i in dates]
+
+
+def closest_running_date(index: CalendarIndex, day: str) -> str | None:
+    # the first running date on or after the day, otherwise the last one before it
+    dates = index[0]
+    if not dates:
+        return None
+    position = bisect_left(dates, day)
+    return dates[position] if position < len(dates) else dates[-1]
+
+
+def index_covers(index: CalendarIndex, day: str) -> bool:
+    return bool(index[0]) and day <= index[0][-1]
+
+
+def lookup_train_id(index: CalendarIndex, day: str) -> int | None:
+    dates, train_ids = index
+    position = bisect_left(dates, day)
+    if position < len(dates) and dates[position] == day:
+        return train_ids[position]
+    return None
+
+
+def parse_train_name(name: str) -> tuple[int, str]:
+    # "NUMBER [NAME]", the number is what the calendars are searched by
+    number, _, train_name = name.partition(" ")
+    if not number.isnumeric():
+        raise ValueError("Invalid train name!")
+    return int(number), train_name
+
+
+def live_interval(stops: list[RealtimeTrainStop], now: datetime) -> float | None:
+    # poll often when the train is about to reach its next stop and rarely in between, None once it has arrived
+    for stop in stops:
+        if stop["actual_departure"] or (stop is stops[-1] and stop["actual_arrival"]):
+            continue
+        next_call = stop["expected_arrival"] or stop["arrival"] or stop["expected_departure"] or stop["departure"]
+        until = (datetime.fromisoformat(next_call).replace(tzinfo=None) - now).total_seconds()
+        return min(max(until / 2, LIVE_MIN_INTERVAL), LIVE_MAX_INTERVAL)
+    return None
+
+
 class TrainInfo(BaseCli):
     async def get_train_calendars(self, brand: str, name: str) -> list[TrainCalendar]:
+        try:
+            return await self.fetch_train_calendars(brand, name)
+        except self.client.errors.KoleoNotFound:
+            await self.error_and_exit(f"Train not found: [underline]{brand} {name}[/underline]")
+
+    async def fetch_train_calendars(self, brand: str, name: str) -> list[TrainCalendar]:
         brand = await self.get_brand_by_shortcut(brand, name=name)
-        name_parts = name.split(" ")
-        if len(name_parts) == 1 and name_parts[0].isnumeric():
-            number = int(name_parts[0])
-            train_name = ""
-        elif len(name_parts) > 1:
-            number = int(name_parts.pop(0))
-            train_name = " ".join(name_parts)
-        else:
-            raise ValueError("Invalid train name!")
+        number, train_name = parse_train_name(name)
 
         cache_id = f"tc-{brand}-{number}-{name}"
+        train_calendars = self.storage.get_cache(cache_id) or self.storage.set_cache(
+            cache_id, await self.client.get_train_calendars(brand, number, train_name), ttl=3600
+        )
+        return train_calendars["train_calendars"]
+
+    async def fetch_calendar_index(self, brand: str, name: str) -> CalendarIndex:
+        train_calendars = await self.fetch_train_calendars(brand, name)
+        return self.storage.set_cache(
+            calendar_index_id(brand, name),
+            calendar_index(train_calendars[0]) if train_calendars else ([], []),
+            ttl=CALENDAR_INDEX_TTL,
+        )
+
+    async def find_train_id(
+        self, brand: str, name: str, date: datetime, closest: bool = False
+    ) -> tuple[str, int | None]:
+        day = date.strftime("%Y-%m-%d")
+        # the index outlives the raw calendar cache, it's only refetched for days past its last running date
+        # which may have been published since, a day inside it that's missing is one the train doesn't run on
+        index = self.storage.get_cache(calendar_index_id(brand, name))
+        if index is None or not index_covers(index, day):
+            index = await self.fetch_calendar_index(brand, name)
+        found = closest_running_date(index, day) if closest else day
+        if found and (train_id := lookup_train_id(index, found)):
+            return found, train_id
+        return found or day, None
+
+    async def get_train_id(self, brand: str, name: str, date: datetime, closest: bool = False) -> tuple[str, int]:
         try:
-            train_calendars = self.storage.get_cache(cache_id) or self.storage.set_cache(
-                cache_id, await self.client.get_train_calendars(brand, number, train_name), ttl=3600
-            )
+            day, train_id = await self.find_train_id(brand, name, date, closest)
         except self.client.errors.KoleoNotFound:
-            await self.error_and_exit(f"Train not found: [underline]nr={number}, name={train_name}[/underline]")
-        return train_calendars["train_calendars"]
+            await self.error_and_exit(f"Train not found: [underline]{brand} {name}[/underline]")
+        if not train_id:
+            await self.error_and_exit(f"This train doesn't run on the selected date: [underline]{day}[/underline]")
+        return day, train_id
+
+    async def train_ids_view(self, trains: list[str], date: datetime, closest: bool = False):
+        # every train is given as "BRAND NUMBER [NAME]", calendars are resolved concurrently
+        # and a bad entry is reported on its own line instead of stopping the others
+        async def resolve(train: str) -> tuple[str, int | None, str | None]:
+            day = date.strftime("%Y-%m-%d")
+            brand, _, name = train.partition(" ")
+            try:
+                parse_train_name(name)
+            except ValueError:
+                return day, None, "invalid train"
+            if not await self.find_brand_by_shortcut(brand, name=name):
+                return day, None, "unknown brand"
+            try:
+                day, train_id = await self.find_train_id(brand, name, date, closest)
+            except self.client.errors.KoleoNotFound:
+                return day, None, "not found"
+            return day, train_id, None if train_id else "doesn't run"
+
+        results = await gather(*(resolve(i) for i in trains))
+        for train, (day, train_id, error) in zip(trains, results):
+            if self.machine_output:
+                self.emit({"train": train, "date": day, "train_id": train_id, "error": error})
+            elif train_id:
+                self.print(f"[red]{train}[/red] [bold green]{day}[/bold green]: [purple]{train_id}[/purple]")
+            else:
+                self.print(f"[red]{train}[/red] [bold green]{day}[/bold green]: [bold red]{error}[/bold red]")
 
     async def train_calendar_view(self, brand: str, name: str):
         train_calendars = await self.get_train_calendars(brand, name)
         brands = await self.get_brands()
         for calendar in train_calendars:
             brand_obj = next(iter(i for i in brands if i["id"] == calendar["trainBrand"]), {})
+            if self.machine_output:
+                self.emit(
+                    {
+                        "train_nr": calendar["train_nr"],
+                        "train_name": calendar.get("train_name"),
+                        "brand_id": calendar["trainBrand"],
+                        "brand": brand_obj.get("logo_text"),
+                        "date_train_map": dict(sorted(calendar["date_train_map"].items())),
+                    }
+                )
+                continue
             link = f"https://koleo.pl/pociag/{brand_obj["name"]}/{name.replace(" ", "-", 1).replace(" ", "%20")}"
             brand = brand_obj.get("logo_text", "")
             self.print(
@@ -43,22 +165,27 @@ class TrainInfo(BaseCli):
                 self.print(f"  [bold green]{k}[/bold green]: [purple]{v}[/purple]")
 
     async def train_info_view(
-        self, brand: str, name: str, date: datetime, closest: bool, show_stations: tuple[str, str] | None = None
+        self,
+        brand: str,
+        name: str,
+        date: datetime,
+        closest: bool,
+        show_stations: tuple[str, str] | None = None,
+        live: bool = False,
+        watch: bool = False,
     ):
-        train_calendars = await self.get_train_calendars(brand, name)
-        if closest:
-            dates = sorted([datetime.strptime(i, "%Y-%m-%d") for i in train_calendars[0]["dates"]])
-            date = next(iter(i for i in dates if i > date)) or next(iter(i for i in reversed(dates) if i < date))
-        if not (train_id := train_calendars[0]["date_train_map"].get(date.strftime("%Y-%m-%d"))):
-            await self.error_and_exit(
-                f"This train doesn't run on the selected date: [underline]{date.strftime("%Y-%m-%d")}[/underline]"
-            )
-        await self.train_detail_view(train_id, date=date.strftime("%Y-%m-%d"), show_stations=show_stations)
+        day, train_id = await self.get_train_id(brand, name, date, closest)
+        await self.train_detail_view(train_id, date=day, show_stations=show_stations, live=live, watch=watch)
 
     async def train_detail_view(
-        self, train_id: int, date: str | None = None, show_stations: tuple[str, str] | None = None
+        self,
+        train_id: int,
+        date: str | None = None,
+        show_stations: tuple[str, str] | None = None,
+        live: bool = False,
+        watch: bool = False,
     ):
-        train_details = await self.client.get_train(train_id)
+        train_details = await self.get_train(train_id, date)
 
         if show_stations:
             first_stop_slug, last_stop_slug = [
@@ -85,8 +212,53 @@ class TrainInfo(BaseCli):
             first_stop, last_stop = train_details["stops"][0], train_details["stops"][-1]
             first_stop_index, last_stop_index = 0, len(train_details["stops"]) + 1
 
+        stops = train_details["stops"][first_stop_index:last_stop_index]
+        operating_day = datetime.strptime(date, "%Y-%m-%d") if date else datetime.now()
+        if watch:
+            await self.show_train_header(train_details, first_stop, last_stop, date)
+            return await self.watch_train_route(train_id, operating_day, stops)
+        realtime = await self.get_realtime_stops(train_id, operating_day) if live else None
+        if self.machine_output:
+            record = {"train_id": train_id, "date": date, "train": train_details["train"], "stops": stops}
+            if realtime is not None:
+                record["realtime"] = [realtime[i["station_id"]] for i in stops if i["station_id"] in realtime]
+            self.emit(record)
+            return
         await self.show_train_header(train_details, first_stop, last_stop, date)
-        self.train_route_table(train_details["stops"][first_stop_index:last_stop_index])
+        self.train_route_table(stops, realtime)
+
+    async def get_realtime_stops(self, train_id: int, operating_day: datetime) -> dict[int, RealtimeTrainStop]:
+        try:
+            timetable = await self.client.realtime_train_timetable(train_id, operating_day)
+        except (self.client.errors.KoleoNotFound, self.client.errors.KoleoUnauthorized):
+            await self.error_and_exit("Realtime data is not available for this train.")
+        return {i["station_id"]: i for i in timetable["stops"]}
+
+    async def watch_train_route(self, train_id: int, operating_day: datetime, stops: list[TrainStop]):
+        previous: dict[int, str] = {}
+        try:
+            while True:
+                realtime = await self.get_realtime_stops(train_id, operating_day)
+                lines = [f"[bold]{datetime.now().strftime("%H:%M:%S")}[/bold]"] if previous else []
+                rows: dict[int, str] = {}
+                for stop in stops:
+                    stop_realtime = realtime.get(stop["station_id"])
+                    rows[stop["station_id"]] = row = self.train_route_row(stop, stops[0]["distance"], stop_realtime)
+                    if previous.get(stop["station_id"]) == row:
+                        continue
+                    if self.machine_output:
+                        self.emit({"train_id": train_id, "stop": stop, "realtime": stop_realtime})
+                    else:
+                        lines.append(row)
+                if len(lines) > bool(previous):
+                    self.print("\n".join(lines))
+                previous = rows
+                watched = [realtime[i["station_id"]] for i in stops if i["station_id"] in realtime]
+                if (interval := live_interval(watched, datetime.now())) is None:
+                    return
+                await sleep(interval)
+        except CancelledError:
+            return
 
     async def show_train_header(
         self, train_details: TrainDetailResponse, first_stop: TrainStop, last_stop: TrainStop, date: str | None = None
@@ -0,0 +1,226 @@
+import typing as t
+from datetime import datetime, timedelta
+from math import inf
+from operator import attrgetter
+
+from koleo.api.types import TrainDetailResponse
+from koleo.snapshot import Snapshot
+
+
+class ElementaryConnection(t.NamedTuple):
+    departure: float
+    arrival: float
+    from_station: int
+    to_station: int
+    train_id: int
+    from_stop: int  # index into the train's stops
+    to_stop: int
+
+
+class PlannedLeg(t.NamedTuple):
+    train_id: int
+    from_stop: int
+    to_stop: int
+    departure: datetime
+    arrival: datetime
+
+
+class PlannedJourney(t.NamedTuple):
+    legs: list[PlannedLeg]
+
+    @property
+    def departure(self) -> datetime:
+        return self.legs[0].departure
+
+    @property
+    def arrival(self) -> datetime:
+        return self.legs[-1].arrival
+
+    @property
+    def changes(self) -> int:
+        return len(self.legs) - 1
+
+
+def stop_datetimes(
+    train: TrainDetailResponse, station_id: int, anchor_time: datetime, type: int = 1
+) -> list[tuple[datetime, datetime]]:
+    # stops only carry the time of day, days are inferred from the times going backwards
+    # and anchored on the departure (1) or arrival (2) seen on a board of the given station
+    offsets: list[tuple[int, int]] = []
+    day, last = 0, -1
+    for stop in train["stops"]:
+        times = []
+        for i in (stop["arrival"], stop["departure"]):
+            minute = i["hour"] * 60 + i["minute"]
+            if minute < last:
+                day += 1
+            last = minute
+            times.append(day * 1440 + minute)
+        offsets.append((times[0], times[1]))
+    index = 1 if type == 1 else 0
+    anchor = next(
+        (times[index] for stop, times in zip(train["stops"], offsets) if stop["station_id"] == station_id),
+        offsets[0][index],
+    )
+    base = anchor_time.replace(second=0, microsecond=0) - timedelta(minutes=anchor)
+    return [(base + timedelta(minutes=arr), base + timedelta(minutes=dep)) for arr, dep in offsets]
+
+
+class Timetable:
+    def __init__(self):
+        self.trains: dict[int, TrainDetailResponse] = {}
+        self.stop_times: dict[int, list[tuple[datetime, datetime]]] = {}
+        self.connections: list[ElementaryConnection] = []
+        self.sorted = True
+
+    def add_train(self, train: TrainDetailResponse, station_id: int, anchor_time: datetime, type: int = 1):
+        train_id = train["train"]["id"]
+        if train_id in self.trains:
+            return
+        self.add_trip(train, stop_datetimes(train, station_id, anchor_time, type))
+
+    def add_trip(self, train: TrainDetailResponse, times: list[tuple[datetime, datetime]]):
+        train_id = train["train"]["id"]
+        self.trains[train_id], self.stop_times[train_id] = train, times
+        stops = train["stops"]
+        for n in range(len(stops) - 1):
+            if stops[n]["exit_only"] or stops[n + 1]["entry_only"]:
+                continue
+            self.connections.append(
+                ElementaryConnection(
+                    times[n][1].timestamp(),
+                    times[n + 1][0].timestamp(),
+                    stops[n]["station_id"],
+                    stops[n + 1]["station_id"],
+                    train_id,
+                    n,
+                    n + 1,
+                )
+            )
+        self.sorted = False
+
+    def add_snapshot(self, snapshot: Snapshot, brand_ids: set[int] | None = None):
+        # snapshot trips only carry what the planner needs, so the train details are partial
+        stations = snapshot.stations()
+        for trip in snapshot.trips():
+            if brand_ids and trip.brand_id not in brand_ids:
+                continue
+            stop_times = snapshot.stop_times(trip)
+            train = {
+                "train": {"id": trip.train_id, "brand_id": trip.brand_id, "train_full_name": trip.name},
+                "stops": [
+                    {
+                        "station_id": i.station_id,
+                        "station_display_name": stations.get(i.station_id, str(i.station_id)),
+                        "platform": i.platform,
+                        "entry_only": i.entry_only,
+                        "exit_only": i.exit_only,
+                    }
+                    for i in stop_times
+                ],
+            }
+            self.add_trip(t.cast(TrainDetailResponse, train), [(i.arrival, i.departure) for i in stop_times])
+
+    def leg(self, enter: ElementaryConnection, exit: ElementaryConnection) -> PlannedLeg:
+        times = self.stop_times[enter.train_id]
+        return PlannedLeg(
+            enter.train_id, enter.from_stop, exit.to_stop, times[enter.from_stop][1], times[exit.to_stop][0]
+        )
+
+    def scan(
+        self, origin: int, destination: int, departure: datetime, min_transfer: timedelta, max_legs: int
+    ) -> list[PlannedJourney]:
+        # connection scan with one label per number of legs, returns the pareto set of (arrival, changes)
+        if not self.sorted:
+            self.connections.sort(key=attrgetter("departure"))
+            self.sorted = True
+        start, transfer = departure.timestamp(), min_transfer.total_seconds()
+        ready: list[dict[int, float]] = [{origin: start} for _ in range(max_legs + 1)]
+        arrival: list[dict[int, float]] = [{} for _ in range(max_legs + 1)]
+        pointers: list[dict[int, tuple[ElementaryConnection, ElementaryConnection]]] = [{} for _ in range(max_legs + 1)]
+        boarded: dict[int, tuple[int, ElementaryConnection]] = {}
+        for c in self.connections:
+            if c.departure < start:
+                continue
+            if c.departure > arrival[max_legs].get(destination, inf):
+                break
+            trip = boarded.get(c.train_id)
+            for legs in range(1, trip[0] if trip else max_legs + 1):
+                if ready[legs - 1].get(c.from_station, inf) <= c.departure:
+                    boarded[c.train_id] = trip = (legs, c)
+                    break
+            if not trip:
+                continue
+            legs, enter = trip
+            if c.to_station == origin:
+                continue
+            for k in range(legs, max_legs + 1):
+                if c.arrival >= arrival[k].get(c.to_station, inf):
+                    break
+                arrival[k][c.to_station] = c.arrival
+                ready[k][c.to_station] = c.arrival + transfer
+                pointers[k][c.to_station] = (enter, c)
+        journeys, best = [], inf
+        for k in range(1, max_legs + 1):
+            if arrival[k].get(destination, inf) >= best:
+                continue
+            best = arrival[k][destination]
+            journeys.append(self.journey(pointers, k, origin, destination))
+        return journeys
+
+    def journey(
+        self,
+        pointers: list[dict[int, tuple[ElementaryConnection, ElementaryConnection]]],
+        legs: int,
+        origin: int,
+        destination: int,
+    ) -> PlannedJourney:
+        result, station = [], destination
+        while station != origin:
+            enter, exit = pointers[legs][station]
+            result.append(self.leg(enter, exit))
+            station, legs = enter.from_station, legs - 1
+        return PlannedJourney(result[::-1])
+
+    def plan(
+        self,
+        origin: int,
+        destination: int,
+        departure: datetime,
+        *,
+        via: list[int] | None = None,
+        min_transfer: timedelta = timedelta(minutes=5),
+        max_legs: int = 4,
+    ) -> list[PlannedJourney]:
+        # via stations are chained as separate scans, continuing from the earliest arrival at each of them
+        points, legs = [origin, *(via or []), destination], []
+        for n in range(len(points) - 1):
+            options = self.scan(points[n], points[n + 1], departure, min_transfer, max_legs - len(legs))
+            if not options:
+                return []
+            if n == len(points) - 2:
+                return [PlannedJourney(legs + i.legs) for i in options]
+            legs += options[-1].legs
+            departure = legs[-1].arrival + min_transfer
+        return []
+
+    def alternatives(
+        self,
+        origin: int,
+        destination: int,
+        departure: datetime,
+        length: int,
+        *,
+        via: list[int] | None = None,
+        min_transfer: timedelta = timedelta(minutes=5),
+        max_legs: int = 4,
+    ) -> list[PlannedJourney]:
+        results: dict[tuple, PlannedJourney] = {}
+        while len(results) < length:
+            journeys = self.plan(origin, destination, departure, via=via, min_transfer=min_transfer, max_legs=max_legs)
+            if not journeys:
+                break
+            for i in journeys:
+                results.setdefault(tuple(i.legs), i)
+            departure = min(i.departure for i in journeys) + timedelta(minutes=1)
+        return sorted(results.values(), key=lambda i: (i.departure, i.arrival))[:length]
@@ -0,0 +1,116 @@
+import cProfile
+import pstats
+import sys
+import threading
+import typing as t
+from argparse import ArgumentParser
+from os.path import basename
+from time import perf_counter
+from types import FrameType
+
+
+PROFILE_REPORT_LIMIT = 30
+SAMPLE_INTERVAL = 0.002
+
+ProfileSort = t.Literal["tottime", "cumulative"]
+
+
+class ProfileOptions(t.NamedTuple):
+    enabled: bool
+    sort: ProfileSort
+    stacks: str | None
+
+
+def add_profile_arguments(parser: ArgumentParser):
+    parser.add_argument(
+        "--profile",
+        help="print the functions the command spent the most time in, network waits show up as the selector poll",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--profile_sort", help="--profile report order", choices=["tottime", "cumulative"], default="tottime"
+    )
+    parser.add_argument("--profile_stacks", help="write sampled stacks in the collapsed flamegraph format to a file")
+
+
+def profile_options(argv: list[str]) -> ProfileOptions:
+    # read before the real parser is built so building and running it is profiled too
+    parser = ArgumentParser(add_help=False)
+    add_profile_arguments(parser)
+    known, _ = parser.parse_known_args(argv)
+    return ProfileOptions(known.profile, known.profile_sort, known.profile_stacks)
+
+
+def frame_name(frame: FrameType) -> str:
+    return f"{basename(frame.f_code.co_filename)}:{frame.f_code.co_qualname}"
+
+
+class StackSampler:
+    # samples the main thread from a background one, coroutines waiting on the network aren't on the stack
+    # so the time spent waiting is attributed to the event loop's selector
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: dict[str, int] = {}
+        self.target = threading.main_thread().ident
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="koleo-profiler", daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame))
+                frame = frame.f_back
+            if names:
+                stack = ";".join(reversed(names))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    def __init__(self, options: ProfileOptions):
+        self.options = options
+        self.profile = cProfile.Profile() if options.enabled else None
+        self.sampler = StackSampler() if options.stacks else None
+        self.started = 0.0
+
+    def __enter__(self) -> t.Self:
+        self.started = perf_counter()
+        if self.sampler:
+            self.sampler.start()
+        if self.profile:
+            self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile:
+            self.profile.disable()
+        if self.sampler:
+            self.sampler.stop()
+        self.report()
+
+    def report(self):
+        # the command's own output is on stdout, so everything here goes to stderr
+        elapsed = perf_counter() - self.started
+        if self.profile:
+            sys.stderr.write(f"\nprofile: {elapsed:.3f}s total, sorted by {self.options.sort}\n")
+            stats = pstats.Stats(self.profile, stream=sys.stderr)
+            stats.strip_dirs().sort_stats(self.options.sort).print_stats(PROFILE_REPORT_LIMIT)
+        if self.sampler and self.options.stacks:
+            self.sampler.write(self.options.stacks)
+            sys.stderr.write(
+                f"{sum(self.sampler.stacks.values())} stack samples written to {self.options.stacks}, render them with flamegraph.pl or speedscope\n"
+            )
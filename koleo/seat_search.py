@@ -0,0 +1,205 @@
+import typing as t
+
+from koleo.api.types import Seat, SeatsAvailabilityResponse, TrainComposition
+from koleo.utils import get_double_key
+
+
+TrainEnd = t.Literal["front", "back"]
+
+WINDOW_PLACEMENT = 1
+# quiet zones are regular seats, every other special compartment (bikes, families, ...) is avoided by default
+REGULAR_SPECIAL_ICONS = {"quiet"}
+
+
+class SeatQuery(t.NamedTuple):
+    window: bool = False
+    compartment: bool = False
+    pair: bool = False
+    end: TrainEnd | None = None
+    allow_special: bool = False
+
+
+class SeatCandidate(t.NamedTuple):
+    score: float
+    place_type: int
+    carriage_nr: str
+    seat_nr: str
+    window: bool
+    empty_compartment: bool
+    partner: str | None
+    special: bool
+    end_proximity: float | None
+
+
+def double_key(seat_nr: str) -> tuple[int, int] | None:
+    # get_double_key for seat numbers that can have a neighbour at all, x0 and x9 don't
+    try:
+        return get_double_key(int(seat_nr))
+    except (KeyError, ValueError):
+        return None
+
+
+def carriage_order(carriage_nr: str) -> int:
+    return int(carriage_nr) if carriage_nr.isnumeric() else 0
+
+
+def end_proximities(composition: TrainComposition | None, end: TrainEnd | None) -> dict[str, float]:
+    # 1.0 for the carriage at the requested end of the train, 0.0 for the one at the other end
+    if not composition or not end or not composition["carriages"]:
+        return {}
+    carriages = sorted(composition["carriages"], key=lambda i: i["positon"])
+    towards_right = composition["direction"]["direction"] == "right"
+    last = max(len(carriages) - 1, 1)
+    proximities = {}
+    for n, carriage in enumerate(carriages):
+        front = n / last if towards_right else 1 - n / last
+        proximities[carriage["number"]] = front if end == "front" else 1 - front
+    return proximities
+
+
+class CarriageIndex:
+    def __init__(self, carriage_nr: str, seats: list[Seat], special_types: set[int]):
+        self.carriage_nr = carriage_nr
+        self.seats = {i["seat_nr"]: i for i in seats}
+        self.free = [i for i in seats if i["state"] == "FREE"]
+        self.special = {i["seat_nr"] for i in seats if i["special_compartment_type_id"] in special_types}
+        self.taken_in_compartment: dict[str, int] = {}
+        self.doubles: dict[tuple[int, int], list[str]] = {}
+        for seat in seats:
+            compartment = seat["seat_nr"][:-1]
+            self.taken_in_compartment[compartment] = self.taken_in_compartment.get(compartment, 0) + (
+                seat["state"] != "FREE"
+            )
+            if key := double_key(seat["seat_nr"]):
+                self.doubles.setdefault(key, []).append(seat["seat_nr"])
+
+    def free_partner(self, seat_nr: str) -> str | None:
+        if not (key := double_key(seat_nr)):
+            return None
+        partners = (i for i in self.doubles[key] if i != seat_nr and i not in self.special)
+        return next((i for i in partners if self.seats[i]["state"] == "FREE"), None)
+
+    def empty_compartment(self, seat_nr: str) -> bool:
+        return self.taken_in_compartment.get(seat_nr[:-1], 1) == 0
+
+
+class SeatIndex:
+    def __init__(self):
+        self.carriages: list[tuple[int, CarriageIndex, float | None]] = []
+
+    def add(
+        self,
+        place_type: int,
+        availability: SeatsAvailabilityResponse,
+        composition: TrainComposition | None = None,
+        end: TrainEnd | None = None,
+    ):
+        special_types = {
+            i["id"] for i in availability["special_compartment_types"] if i["icon"] not in REGULAR_SPECIAL_ICONS
+        }
+        by_carriage: dict[str, list[Seat]] = {}
+        for seat in availability["seats"]:
+            by_carriage.setdefault(seat["carriage_nr"], []).append(seat)
+        proximities = end_proximities(composition, end)
+        for carriage_nr, seats in by_carriage.items():
+            self.carriages.append(
+                (place_type, CarriageIndex(carriage_nr, seats, special_types), proximities.get(carriage_nr))
+            )
+        self.carriages.sort(key=lambda i: (-(i[2] or 0), i[0], carriage_order(i[1].carriage_nr)))
+
+    def candidates(self, query: SeatQuery) -> t.Iterator[SeatCandidate]:
+        for place_type, carriage, proximity in self.carriages:
+            for seat in carriage.free:
+                special = seat["seat_nr"] in carriage.special
+                if special and not query.allow_special:
+                    continue
+                window = seat.get("placement_id") == WINDOW_PLACEMENT
+                empty = carriage.empty_compartment(seat["seat_nr"])
+                partner = carriage.free_partner(seat["seat_nr"]) if query.pair else None
+                score = (
+                    (query.window and window)
+                    + (query.compartment and empty)
+                    + (query.pair and partner is not None)
+                    + ((proximity or 0) if query.end else 0)
+                    - special
+                )
+                yield SeatCandidate(
+                    float(score),
+                    place_type,
+                    carriage.carriage_nr,
+                    seat["seat_nr"],
+                    window,
+                    empty,
+                    partner,
+                    special,
+                    proximity,
+                )
+
+    def find_first(self, query: SeatQuery) -> SeatCandidate | None:
+        # carriages are already ordered by the requested end, the first seat matching every constraint wins
+        return next(
+            (
+                i
+                for i in self.candidates(query)
+                if (not query.window or i.window)
+                and (not query.compartment or i.empty_compartment)
+                and (not query.pair or i.partner)
+            ),
+            None,
+        )
+
+    def find_best(self, query: SeatQuery, limit: int = 5) -> list[SeatCandidate]:
+        return sorted(self.candidates(query), key=lambda i: -i.score)[:limit]
+
+
+SeatKey = tuple[int, str, str]  # place type, carriage, seat
+
+
+def segment_masks(segments: list[dict[int, SeatsAvailabilityResponse]]) -> dict[SeatKey, int]:
+    # bit n is set when the seat is free on the n-th segment of the journey
+    masks: dict[SeatKey, int] = {}
+    for n, availability in enumerate(segments):
+        for place_type, response in availability.items():
+            for seat in response["seats"]:
+                key = (place_type, seat["carriage_nr"], seat["seat_nr"])
+                masks[key] = masks.get(key, 0) | ((seat["state"] == "FREE") << n)
+    return masks
+
+
+def free_run(mask: int, start: int) -> int:
+    # how many consecutive segments the seat stays free for, starting at the given one
+    return ((~mask >> start) & -(~mask >> start)).bit_length() - 1
+
+
+def minimal_seat_changes(masks: dict[SeatKey, int], segments: int) -> list[tuple[SeatKey, int, int]] | None:
+    # greedily taking the seat that stays free the longest is optimal for covering the journey
+    plan, position = [], 0
+    while position < segments:
+        key, run = max(((k, free_run(v, position)) for k, v in masks.items()), key=lambda i: i[1], default=(None, 0))
+        if not run:
+            return None
+        end = min(position + run, segments)
+        plan.append((key, position, end))
+        position = end
+    return plan
+
+
+def merge_segments(segments: list[dict[int, SeatsAvailabilityResponse]]) -> dict[int, SeatsAvailabilityResponse]:
+    # a seat is only free on the whole journey when it's free on every segment
+    full = (1 << len(segments)) - 1
+    masks = segment_masks(segments)
+    return {
+        place_type: {
+            "special_compartment_types": response["special_compartment_types"],
+            "seats": [
+                {
+                    **seat,
+                    "state": "FREE"
+                    if masks[(place_type, seat["carriage_nr"], seat["seat_nr"])] == full
+                    else "RESERVED",
+                }
+                for seat in response["seats"]
+            ],
+        }
+        for place_type, response in segments[0].items()
+    }
@@ -0,0 +1,150 @@
+import mmap
+import os
+import struct
+import typing as t
+from datetime import datetime
+
+from koleo.api.types import TrainDetailResponse
+
+
+# all integers are little endian, times are minutes since the unix epoch
+# header: magic, version, station count, trip count, stop time count, string table size
+HEADER = struct.Struct("<4sHIIII")
+# station: id, name offset, name length
+STATION = struct.Struct("<iIH")
+# trip: train id, brand id, name offset, name length, first stop time, stop count
+TRIP = struct.Struct("<iiIHIH")
+# stop time: station id, arrival, departure, platform offset, platform length, flags
+STOP_TIME = struct.Struct("<iiiIHB")
+MAGIC = b"KLSN"
+VERSION = 1
+ENTRY_ONLY, EXIT_ONLY = 1, 2
+
+
+class SnapshotError(Exception): ...
+
+
+class Trip(t.NamedTuple):
+    train_id: int
+    brand_id: int
+    name: str
+    first_stop: int
+    stop_count: int
+
+
+class StopTime(t.NamedTuple):
+    station_id: int
+    arrival: datetime
+    departure: datetime
+    platform: str
+    entry_only: bool
+    exit_only: bool
+
+
+class StringTable:
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets: dict[str, tuple[int, int]] = {}
+
+    def add(self, value: str) -> tuple[int, int]:
+        if value not in self.offsets:
+            encoded = value.encode()
+            self.offsets[value] = (len(self.data), len(encoded))
+            self.data += encoded
+        return self.offsets[value]
+
+
+def write_snapshot(
+    path: str,
+    stations: dict[int, str],
+    trains: list[tuple[TrainDetailResponse, list[tuple[datetime, datetime]]]],
+):
+    strings = StringTable()
+    station_data = bytearray()
+    for id, name in sorted(stations.items()):
+        station_data += STATION.pack(id, *strings.add(name))
+    trip_data, stop_time_data, stop_count = bytearray(), bytearray(), 0
+    for train, times in sorted(trains, key=lambda i: i[0]["train"]["id"]):
+        trip_data += TRIP.pack(
+            train["train"]["id"],
+            train["train"]["brand_id"],
+            *strings.add(train["train"]["train_full_name"]),
+            stop_count,
+            len(train["stops"]),
+        )
+        for stop, (arr, dep) in zip(train["stops"], times):
+            flags = (ENTRY_ONLY if stop["entry_only"] else 0) | (EXIT_ONLY if stop["exit_only"] else 0)
+            stop_time_data += STOP_TIME.pack(
+                stop["station_id"],
+                int(arr.timestamp() // 60),
+                int(dep.timestamp() // 60),
+                *strings.add(stop["platform"] or ""),
+                flags,
+            )
+        stop_count += len(train["stops"])
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(stations), len(trains), stop_count, len(strings.data)))
+        f.write(station_data)
+        f.write(trip_data)
+        f.write(stop_time_data)
+        f.write(strings.data)
+
+
+class Snapshot:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            # an empty file can't be mapped, an interrupted build leaves one behind
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise SnapshotError(f"{path} is not a koleo snapshot")
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.station_count, self.trip_count, self.stop_time_count, strings_size = HEADER.unpack_from(
+            self.data
+        )
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not a koleo snapshot")
+        if version != VERSION:
+            raise SnapshotError(f"{path} is a v{version} snapshot, rebuild it with this version (v{VERSION})")
+        self.stations_offset = HEADER.size
+        self.trips_offset = self.stations_offset + self.station_count * STATION.size
+        self.stop_times_offset = self.trips_offset + self.trip_count * TRIP.size
+        self.strings_offset = self.stop_times_offset + self.stop_time_count * STOP_TIME.size
+        if len(self.data) != self.strings_offset + strings_size:
+            raise SnapshotError(f"{path} is truncated")
+
+    def close(self):
+        self.data.close()
+
+    def string(self, offset: int, length: int) -> str:
+        start = self.strings_offset + offset
+        return self.data[start : start + length].decode()
+
+    def stations(self) -> dict[int, str]:
+        return {
+            id: self.string(offset, length)
+            for id, offset, length in STATION.iter_unpack(self.data[self.stations_offset : self.trips_offset])
+        }
+
+    def trip(self, index: int) -> Trip:
+        train_id, brand_id, offset, length, first_stop, stop_count = TRIP.unpack_from(
+            self.data, self.trips_offset + index * TRIP.size
+        )
+        return Trip(train_id, brand_id, self.string(offset, length), first_stop, stop_count)
+
+    def trips(self) -> t.Iterator[Trip]:
+        return (self.trip(i) for i in range(self.trip_count))
+
+    def stop_times(self, trip: Trip) -> list[StopTime]:
+        start = self.stop_times_offset + trip.first_stop * STOP_TIME.size
+        return [
+            StopTime(
+                station_id,
+                datetime.fromtimestamp(arr * 60),
+                datetime.fromtimestamp(dep * 60),
+                self.string(offset, length),
+                bool(flags & ENTRY_ONLY),
+                bool(flags & EXIT_ONLY),
+            )
+            for station_id, arr, dep, offset, length, flags in STOP_TIME.iter_unpack(
+                self.data[start : start + trip.stop_count * STOP_TIME.size]
+            )
+        ]
@@ -84,11 +84,26 @@ class Storage:
         self._path: str
         self._dirty = False
         self._ignore_cache = False
+        self._cache_hits: dict[str, int] = {}
+        self._cache_misses: dict[str, int] = {}
 
     @property
     def dirty(self) -> bool:
         return self._dirty
 
+    @property
+    def cache_stats(self) -> dict[str, tuple[int, int]]:
+        # hits and misses per cache key prefix (conn, tr, price, ...) since the storage was loaded
+        return {
+            kind: (self._cache_hits.get(kind, 0), self._cache_misses.get(kind, 0))
+            for kind in sorted(self._cache_hits.keys() | self._cache_misses.keys())
+        }
+
+    def count_cache(self, id: str, hit: bool):
+        counters = self._cache_hits if hit else self._cache_misses
+        kind = id.partition("-")[0]
+        counters[kind] = counters.get(kind, 0) + 1
+
     @classmethod
     def load(cls, *, path: str = DEFAULT_CONFIG_PATH, ignore_cache: bool = False) -> t.Self:
         expanded = ospath.expanduser(path)
@@ -104,14 +119,18 @@ class Storage:
 
     def get_cache(self, id: str) -> t.Any | None:
         if self.disable_cache or self._ignore_cache:
+            self.count_cache(id, False)
             return None
         cache_result = self.cache.get(id)
         if not cache_result:
+            self.count_cache(id, False)
             return None
         expiry, item = cache_result
         if expiry > time():
+            self.count_cache(id, True)
             return item
         else:
+            self.count_cache(id, False)
             self.cache.pop(id)
             self._dirty = True
 
@@ -3,7 +3,7 @@ from datetime import datetime, time, timedelta
 from typing import TYPE_CHECKING, Any
 from copy import deepcopy
 
-from .api.types import SeatsAvailabilityResponse, TimeDict, TrainComposition
+from .api.types import EstimatedTrainTime, SeatsAvailabilityResponse, TimeDict, TrainComposition
 
 if TYPE_CHECKING:
     from argparse import ArgumentParser, _SubParsersAction
@@ -72,6 +72,25 @@ def koleo_time_to_dt(i: TimeDict | str, *, base_date: datetime | None = None):
     return datetime.combine(base_date, time(i["hour"], i["minute"], i["second"]))
 
 
+def minutes_between(start: str, end: str | None) -> int | None:
+    if not end:
+        return None
+    return int((datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds() // 60)
+
+
+def estimated_delay(estimate: EstimatedTrainTime | None, type: int = 1) -> int | None:
+    if not estimate:
+        return None
+    aimed, actual = (
+        (estimate["aimed_departure"], estimate["actual_departure"])
+        if type == 1
+        else (estimate["aimed_arrival"], estimate["actual_arrival"])
+    )
+    if not aimed:
+        return None
+    return minutes_between(aimed, actual)
+
+
 TRANSLITERATIONS = {
     "ł": "l",
     "ń": "n",
@@ -168,7 +187,7 @@ def get_double_key(seat: int) -> tuple[int, int]:
     # x4, x6 -> x, 4
     # x0, x9 nie istnieją!
     seat_nr = str(seat)
-    return int(seat_nr[:-1]), SEAT_GROUPS[int(seat_nr[-1])]
+    return int(seat_nr[:-1] or 0), SEAT_GROUPS[int(seat_nr[-1])]
 
 
 def find_empty_doubles(